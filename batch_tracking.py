@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import time
+import cv2
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from ultralytics import YOLO
+
+from tracking_france_usa_withlimitedid import (
+    GROUP_COLORS, ID_POOL_SIZES, INFER_OPTIONS, LongRunGuard, build_id_pools, close_outputs, get_group_lut, load_profile,
+    model_view, open_capture, open_outputs, run_serial,
+)
+
+# -------------------------------
+# track one video with isolated tracker and id-pool state
+# -------------------------------
+def track_video(model, video_path, tracker_type, output_dir, delay_frames=10, pool_sizes=ID_POOL_SIZES,
+                batch_size=8, infer_options=INFER_OPTIONS, decode_threads=0, hw_accel=False, write_video=False,
+                long_run_options=None):
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    cap = open_capture(video_path, decode_threads, hw_accel)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+
+    id_map = {}
+    lost_ids = OrderedDict()
+    available_ids = build_id_pools(pool_sizes)
+    video_out = os.path.join(output_dir, f"{name}_tracked.mp4") if write_video else None
+    outputs = open_outputs(None, video_out, os.path.join(output_dir, f"{name}_tracks.csv"), fps,
+                           track_log=os.path.join(output_dir, f"{name}_tracks"))
+
+    # one guard per video, a tournament day of videos then runs in one process with flat memory
+    long_run = LongRunGuard(long_run_options) if long_run_options else None
+    view = model_view(model)
+
+    start_time = time.perf_counter()
+    try:
+        frame_count = run_serial(cap, view, tracker_type, id_map, available_ids, GROUP_COLORS, lost_ids, delay_frames,
+                                 outputs, batch_size, infer_options, long_run=long_run)
+    finally:
+        cap.release()
+        close_outputs(outputs)
+    elapsed = time.perf_counter() - start_time
+
+    summary = {
+        "video": video_path,
+        "frames": frame_count,
+        "seconds": round(elapsed, 2),
+        "fps": round(frame_count / max(elapsed, 1e-9), 2),
+        # ids handed out / returned per group, high numbers mean tracks keep getting lost and renumbered
+        "ids_assigned": {g_key: pool.acquired for g_key, pool in available_ids.items()},
+        "ids_released": {g_key: pool.released for g_key, pool in available_ids.items()},
+        "lost_at_end": len(lost_ids),
+    }
+    if long_run is not None:
+        summary["memory"] = long_run.report(frame_count, view, lost_ids)
+    with open(os.path.join(output_dir, f"{name}_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+# -------------------------------
+# run a queue of videos against one loaded model
+# -------------------------------
+def run_batch(video_paths, model_path, tracker_type, output_dir, concurrent_videos=2, **track_kwargs):
+    os.makedirs(output_dir, exist_ok=True)
+    model = YOLO(model_path)
+    get_group_lut(model.names)
+
+    # the first predict sets up the backend, which fuses conv + batchnorm in place on the shared weights;
+    # done once here, concurrent first calls from the video threads would race on the fuse
+    device = (track_kwargs.get("infer_options") or INFER_OPTIONS).get("device")
+    warmup_kwargs = {"device": device} if device is not None else {}
+    model_view(model).predict(np.zeros((64, 64, 3), dtype=np.uint8), verbose=False, **warmup_kwargs)
+
+    with ThreadPoolExecutor(max_workers=concurrent_videos) as executor:
+        futures = [executor.submit(track_video, model, video_path, tracker_type, output_dir, **track_kwargs)
+                   for video_path in video_paths]
+        return [future.result() for future in futures]
+
+# -------------------------------
+# Main Function
+# -------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Track a queue of match videos with one loaded model.")
+    parser.add_argument("videos", nargs="*", help="videos to track, defaults to the profile's video_path")
+    parser.add_argument("--profile", help="JSON run profile, see tracking_profile.json")
+    parser.add_argument("--output-dir", default="tracking_runs")
+    args = parser.parse_args(argv)
+
+    profile = load_profile(args.profile)
+    video_paths = args.videos or [profile["video_path"]]
+    concurrent_videos = profile["workers"] or os.cpu_count()
+    track_kwargs = {
+        "delay_frames": profile["delay_frames"],
+        "pool_sizes": profile["id_pools"],
+        "batch_size": profile["batch_size"],
+        "infer_options": profile["infer"],
+        "decode_threads": profile["decode_threads"],
+        "hw_accel": profile["hw_accel"],
+        "write_video": bool(profile["outputs"]["video_out"]),
+        "long_run_options": profile["long_run"] if profile["long_run"]["enabled"] else None,
+    }
+
+    for summary in run_batch(video_paths, profile["model_path"], profile["tracker_type"], args.output_dir,
+                             concurrent_videos, **track_kwargs):
+        print(f"{summary['video']}: {summary['frames']} frames in {summary['seconds']}s ({summary['fps']} fps)")
+
+if __name__ == "__main__":
+    main()
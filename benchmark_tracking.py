@@ -0,0 +1,280 @@
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from collections import OrderedDict
+
+from tracking_france_usa_withlimitedid import (
+    GROUP_COLORS, ID_POOL_SIZES, build_id_pools, draw_tracks, rss_mb, stage_times, track_batch,
+)
+
+# -------------------------------
+# synthetic stand-in for the YOLO model, deterministic for a given seed
+# -------------------------------
+# same class names as the trained model, "crowd" is detected but never tracked
+SYNTHETIC_NAMES = {0: "ball", 1: "france_player", 2: "USA_player", 3: "referee", 4: "france_gk", 5: "usa_gk", 6: "crowd"}
+
+# objects on the pitch per class, one more player per team than the id pools hold by default
+# so pool exhaustion is part of every run
+SCENE_OBJECTS = {
+    "france_player": 11,
+    "USA_player": 11,
+    "referee": 3,
+    "france_gk": 1,
+    "usa_gk": 1,
+    "ball": 1,
+    "crowd": 4,
+}
+
+class HostArray:
+    # mimics the .cpu().numpy() chain of an Ultralytics tensor
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+class SyntheticBoxes:
+    def __init__(self, data):
+        self.data = HostArray(data)
+        self.id = HostArray(data[:, 4]) if len(data) else None
+
+class SyntheticResult:
+    def __init__(self, data):
+        self.boxes = SyntheticBoxes(data)
+
+class SyntheticScene:
+    # objects move with constant velocity and bounce off the image border; every frame each object can
+    # start an occlusion (no detection for a few frames) and can get a new tracker id (an id swap)
+    def __init__(self, objects=SCENE_OBJECTS, names=SYNTHETIC_NAMES, size=(1920, 1080), occlusion_rate=0.01,
+                 max_occlusion=40, swap_rate=0.002, seed=0):
+        class_ids = {class_name: cls for cls, class_name in names.items()}
+        self.rng = np.random.default_rng(seed)
+        self.size = np.array(size, dtype=np.float32)
+        self.occlusion_rate = occlusion_rate
+        self.max_occlusion = max_occlusion
+        self.swap_rate = swap_rate
+
+        self.classes = np.array([class_ids[name] for name, count in objects.items() for _ in range(count)])
+        n = len(self.classes)
+        self.box_size = np.where(self.classes[:, None] == class_ids.get("ball", -1), (12, 12), (40, 90)).astype(np.float32)
+        self.positions = self.rng.uniform((0, 0), self.size - self.box_size, (n, 2)).astype(np.float32)
+        self.velocities = self.rng.uniform(-8, 8, (n, 2)).astype(np.float32)
+        self.track_ids = np.arange(1, n + 1)
+        self.next_track_id = n + 1
+        self.hidden = np.zeros(n, dtype=int)  # frames left until the object is detected again
+        self.frame_count = 0
+
+    def step(self):
+        # [M, 7] detections of the next frame, in boxes.data layout
+        n = len(self.classes)
+        self.frame_count += 1
+
+        self.positions += self.velocities
+        limit = self.size - self.box_size
+        bounced = (self.positions < 0) | (self.positions > limit)
+        self.velocities[bounced] *= -1
+        np.clip(self.positions, 0, limit, out=self.positions)
+
+        self.hidden = np.maximum(self.hidden - 1, 0)
+        occluded = (self.hidden == 0) & (self.rng.random(n) < self.occlusion_rate)
+        self.hidden[occluded] = self.rng.integers(1, self.max_occlusion + 1, occluded.sum())
+
+        swapped = np.flatnonzero(self.rng.random(n) < self.swap_rate)
+        self.track_ids[swapped] = np.arange(self.next_track_id, self.next_track_id + len(swapped))
+        self.next_track_id += len(swapped)
+
+        visible = self.hidden == 0
+        data = np.empty((visible.sum(), 7), dtype=np.float32)
+        data[:, 0:2] = self.positions[visible]
+        data[:, 2:4] = self.positions[visible] + self.box_size[visible]
+        data[:, 4] = self.track_ids[visible]
+        data[:, 5] = 0.9
+        data[:, 6] = self.classes[visible]
+        return data
+
+class SyntheticDetector:
+    # enough of the YOLO interface for track_batch / process_frame
+    def __init__(self, scene, names=SYNTHETIC_NAMES):
+        self.scene = scene
+        self.names = names
+        self.callbacks = {}
+        self.predictor = None
+
+    def track(self, source, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        return [SyntheticResult(self.scene.step()) for _ in frames]
+
+# -------------------------------
+# id-state check
+# -------------------------------
+def check_id_state(id_map, available_ids, lost_ids, pool_sizes=ID_POOL_SIZES, first_id=1):
+    # every fixed id must be exactly once in its pool, in id_map or in lost_ids; returns the problems found
+    held = {g_key: list(pool.free) for g_key, pool in available_ids.items()}
+    for assigned_id, g_key in id_map.values():
+        held[g_key].append(assigned_id)
+    for (assigned_id, g_key), _ in lost_ids.values():
+        held[g_key].append(assigned_id)
+
+    problems = []
+    for g_key, size in pool_sizes.items():
+        expected = list(range(first_id, first_id + size))
+        if sorted(held[g_key]) != expected:
+            problems.append(f"{g_key}: ids {sorted(held[g_key])}, expected {expected}")
+        first_id += size
+    return problems
+
+# -------------------------------
+# benchmarks
+# -------------------------------
+def bench_assign(frames=100000, batch_size=8, delay_frames=10, pool_sizes=ID_POOL_SIZES, scene_kwargs=None,
+                 checkpoints=10):
+    # detector stand-in -> track_batch -> assign_ids, no decoding and no drawing
+    model = SyntheticDetector(SyntheticScene(**(scene_kwargs or {})))
+    id_map = {}
+    lost_ids = OrderedDict()
+    available_ids = build_id_pools(pool_sizes)
+    placeholders = [None] * batch_size
+
+    stage_times.reset()
+    memory = []
+    problems = []
+    checkpoint_every = max(frames // checkpoints, batch_size)
+    next_checkpoint = checkpoint_every
+    tracked = 0
+
+    start_time = time.perf_counter()
+    frame_count = 0
+    while frame_count < frames:
+        batch = placeholders[:min(batch_size, frames - frame_count)]
+        for tracks in track_batch(batch, model, None, id_map, available_ids, lost_ids, delay_frames, frame_count):
+            tracked += len(tracks)
+        frame_count += len(batch)
+
+        if frame_count >= next_checkpoint:
+            memory.append({"frame": frame_count, "rss_mb": round(rss_mb(), 1), "id_map": len(id_map),
+                           "lost_ids": len(lost_ids)})
+            problems.extend(f"frame {frame_count}: {problem}"
+                            for problem in check_id_state(id_map, available_ids, lost_ids, pool_sizes))
+            next_checkpoint += checkpoint_every
+    elapsed = time.perf_counter() - start_time
+
+    timings = stage_times.summary()
+    return {
+        "frames": frames,
+        "seconds": round(elapsed, 3),
+        "fps": round(frames / max(elapsed, 1e-9), 1),
+        "tracks_per_frame": round(tracked / max(frames, 1), 2),
+        "assign_ms": {key: timings["assign"][key] for key in ("mean_ms", "p50_ms", "p95_ms", "p99_ms")},
+        # rss after the first checkpoint vs the last one, state is expected to stay flat after warmup
+        "rss_growth_mb": round(memory[-1]["rss_mb"] - memory[0]["rss_mb"], 1) if memory else 0.0,
+        "memory": memory,
+        # deterministic for a seed, any change here means the id recycling behaves differently
+        "ids_assigned": {g_key: pool.acquired for g_key, pool in available_ids.items()},
+        "ids_released": {g_key: pool.released for g_key, pool in available_ids.items()},
+        "id_state_problems": problems[:20],
+    }
+
+def bench_render(frames=2000, batch_size=8, delay_frames=10, pool_sizes=ID_POOL_SIZES, scene_kwargs=None,
+                 size=(1920, 1080)):
+    # same loop plus drawing on a blank full-size frame, the per-frame cost of process_frame minus the model
+    scene_kwargs = dict(scene_kwargs or {}, size=size)
+    model = SyntheticDetector(SyntheticScene(**scene_kwargs))
+    id_map = {}
+    lost_ids = OrderedDict()
+    available_ids = build_id_pools(pool_sizes)
+    canvas = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+
+    stage_times.reset()
+    start_time = time.perf_counter()
+    frame_count = 0
+    while frame_count < frames:
+        batch = [canvas] * min(batch_size, frames - frame_count)
+        for tracks in track_batch(batch, model, None, id_map, available_ids, lost_ids, delay_frames, frame_count):
+            draw_start = time.perf_counter()
+            draw_tracks(canvas, tracks, GROUP_COLORS)
+            stage_times.add("draw", time.perf_counter() - draw_start)
+        frame_count += len(batch)
+    elapsed = time.perf_counter() - start_time
+
+    timings = stage_times.summary()
+    return {
+        "frames": frames,
+        "seconds": round(elapsed, 3),
+        "fps": round(frames / max(elapsed, 1e-9), 1),
+        "draw_ms": {key: timings["draw"][key] for key in ("mean_ms", "p50_ms", "p95_ms", "p99_ms")},
+    }
+
+# -------------------------------
+# regression check against a saved run
+# -------------------------------
+def compare(results, baseline, tolerance=0.2):
+    # fps may drop by at most tolerance, id churn must match exactly and the id state must stay consistent
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["fps"] < base["fps"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['fps']} fps, baseline {base['fps']} fps")
+        for key in ("ids_assigned", "ids_released"):
+            # churn is only comparable for the same number of frames
+            if key in base and base["frames"] == result["frames"] and result.get(key) != base[key]:
+                regressions.append(f"{name}: {key} {result.get(key)}, baseline {base[key]}")
+        if result.get("id_state_problems"):
+            regressions.append(f"{name}: {len(result['id_state_problems'])} id state problems")
+    return regressions
+
+# -------------------------------
+# Main Function
+# -------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tracking loop against a synthetic detector.")
+    parser.add_argument("--frames", type=int, default=100000, help="frames for the id assignment benchmark")
+    parser.add_argument("--render-frames", type=int, default=2000, help="frames for the drawing benchmark, 0 skips it")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--delay-frames", type=int, default=10)
+    parser.add_argument("--players", type=int, default=SCENE_OBJECTS["france_player"], help="outfield players per team")
+    parser.add_argument("--occlusion-rate", type=float, default=0.01, help="per object and frame")
+    parser.add_argument("--max-occlusion", type=int, default=40, help="longest occlusion in frames")
+    parser.add_argument("--swap-rate", type=float, default=0.002, help="tracker id swaps per object and frame")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative fps drop vs the baseline")
+    args = parser.parse_args(argv)
+
+    objects = dict(SCENE_OBJECTS, france_player=args.players, USA_player=args.players)
+    scene_kwargs = {"objects": objects, "occlusion_rate": args.occlusion_rate, "max_occlusion": args.max_occlusion,
+                    "swap_rate": args.swap_rate, "seed": args.seed}
+    common = {"batch_size": args.batch_size, "delay_frames": args.delay_frames, "scene_kwargs": scene_kwargs}
+
+    results = {"assign": bench_assign(args.frames, **common)}
+    if args.render_frames:
+        results["render"] = bench_render(args.render_frames, **common)
+
+    for name, result in results.items():
+        print(f"{name}: {result['frames']} frames in {result['seconds']}s ({result['fps']} fps)")
+    assign = results["assign"]
+    print(f"assign per frame: {assign['assign_ms']}, rss growth {assign['rss_growth_mb']} MB")
+    for problem in assign["id_state_problems"]:
+        print(f"id state: {problem}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"settings": vars(args), **results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
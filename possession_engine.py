@@ -0,0 +1,226 @@
+import json
+import os
+from collections import deque
+import numpy as np
+
+# -------------------------------
+# teams of the tracked groups, refs are ignored for possession
+# -------------------------------
+TEAM_OF_GROUP = {
+    "france_players": "France",
+    "france_GK": "France",
+    "USA_players": "USA",
+    "USA_GK": "USA",
+}
+
+PITCH_WIDTH = 68
+PITCH_LENGTH = 105
+
+def as_loc(point):
+    return [round(float(point[0]), 2), round(float(point[1]), 2)]
+
+# -------------------------------
+# streaming possession / event detection from per-frame pitch positions
+# -------------------------------
+class PossessionEngine:
+    # fed one frame at a time; keeps only the open possession and the current ball holder,
+    # so memory stays bounded and the cost per frame only depends on the number of players
+    def __init__(self, control_radius=1.5, min_control_frames=3, lost_ball_frames=25, dribble_min_distance=3.0,
+                 path_step=5, max_path=20):
+        self.control_radius = control_radius  # metres between ball and foot point to count as control
+        self.min_control_frames = min_control_frames  # frames a new player needs to keep the ball
+        self.lost_ball_frames = lost_ball_frames  # frames without a ball before the possession ends
+        self.dribble_min_distance = dribble_min_distance  # metres carried before a carry counts as dribble
+        self.path_step = path_step
+        self.max_path = max_path
+
+        self.possession = None
+        self.holder = None
+        self.candidate = None  # (player, team, consecutive frames)
+        self.ball = None
+        self.last_ball_frame = None
+        self.next_possession_id = 1
+
+    def update(self, frame_count, tracks, locations):
+        # tracks as produced by assign_ids, locations [N, 2] in metres (NaN rows are ignored);
+        # returns the possessions that ended on this frame
+        finished = []
+        ball = None
+        ids, teams, points = [], [], []
+        for (assigned_id, g_key, _, _), location in zip(tracks, locations):
+            if np.isnan(location[0]):
+                continue
+            if g_key == "ball":
+                ball = location
+            elif g_key in TEAM_OF_GROUP:
+                ids.append(assigned_id)
+                teams.append(TEAM_OF_GROUP[g_key])
+                points.append(location)
+
+        if ball is None:
+            if self.possession is not None and frame_count - self.last_ball_frame > self.lost_ball_frames:
+                finished.append(self.end_possession(self.last_ball_frame, "ball_lost"))
+            return finished
+
+        self.ball = ball
+        self.last_ball_frame = frame_count
+
+        if not (0 <= ball[0] <= PITCH_WIDTH and 0 <= ball[1] <= PITCH_LENGTH):
+            if self.possession is not None:
+                finished.append(self.end_possession(frame_count, "out_of_play"))
+            return finished
+
+        if not points:
+            return finished
+
+        distances = np.hypot(*(np.asarray(points) - ball).T)
+        nearest = int(distances.argmin())
+        if distances[nearest] > self.control_radius:
+            self.candidate = None
+            return finished
+
+        player, team = ids[nearest], teams[nearest]
+        if self.holder is not None and self.holder["player"] == player:
+            self.carry(frame_count)
+            self.candidate = None
+            return finished
+
+        count = self.candidate[2] + 1 if self.candidate and self.candidate[0] == player else 1
+        self.candidate = (player, team, count)
+        if count >= self.min_control_frames:
+            finished.extend(self.change_control(frame_count, player, team))
+            self.candidate = None
+        return finished
+
+    def finish(self, frame_count):
+        # closes the open possession at the end of the stream
+        if self.possession is None:
+            return []
+        return [self.end_possession(frame_count, "end_of_stream")]
+
+    # ---- internals ----
+    def start_possession(self, frame_count, team):
+        self.possession = {
+            "possession_id": self.next_possession_id,
+            "team": team,
+            "start_frame": frame_count,
+            "end_frame": None,
+            "start_location_m": as_loc(self.ball),
+            "end_location_m": None,
+            "end_reason": None,
+            "end_team": None,
+            "actions": [],
+        }
+        self.next_possession_id += 1
+
+    def end_possession(self, frame_count, reason, end_team=None):
+        self.close_carry()
+        possession = self.possession
+        possession["end_frame"] = frame_count
+        possession["end_location_m"] = as_loc(self.ball)
+        possession["end_reason"] = reason
+        possession["end_team"] = end_team
+        self.possession = None
+        return possession
+
+    def change_control(self, frame_count, player, team):
+        finished = []
+        previous = self.holder
+        self.close_carry()
+
+        if self.possession is None:
+            self.start_possession(frame_count, team)
+        elif self.possession["team"] == team:
+            if previous is not None:
+                self.possession["actions"].append({
+                    "type": "controlled_pass",
+                    "from": previous["player"],
+                    "to": player,
+                    "start_frame": previous["last_frame"],
+                    "end_frame": frame_count,
+                    "start_location_m": as_loc(previous["location"]),
+                    "end_location_m": as_loc(self.ball),
+                })
+            self.possession["actions"].append({
+                "type": "receive",
+                "player": player,
+                "player_number": player,
+                "frame": frame_count,
+                "location_m": as_loc(self.ball),
+            })
+        else:
+            action = {
+                "type": "pass_intercepted",
+                "player": player,
+                "player_number": player,
+                "by_team": team,
+                "frame": frame_count,
+                "location_m": as_loc(self.ball),
+            }
+            if previous is not None:
+                action["from"] = previous["player"]
+                action["start_location_m"] = as_loc(previous["location"])
+                action["end_location_m"] = as_loc(self.ball)
+            self.possession["actions"].append(action)
+            finished.append(self.end_possession(frame_count, "interception", team))
+            self.start_possession(frame_count, team)
+
+        self.holder = {
+            "player": player,
+            "start_frame": frame_count,
+            "last_frame": frame_count,
+            "start_location": self.ball.copy(),
+            "location": self.ball.copy(),
+            "path": deque([as_loc(self.ball)], maxlen=self.max_path),
+        }
+        return finished
+
+    def carry(self, frame_count):
+        holder = self.holder
+        holder["last_frame"] = frame_count
+        holder["location"] = self.ball.copy()
+        if (frame_count - holder["start_frame"]) % self.path_step == 0:
+            holder["path"].append(as_loc(self.ball))
+
+    def close_carry(self):
+        # a carry long enough becomes a dribble action of the open possession; the holder is cleared,
+        # so a carry is closed once even when an interception also ends the possession
+        holder, self.holder = self.holder, None
+        if holder is None or self.possession is None:
+            return
+        if np.hypot(*(holder["location"] - holder["start_location"])) < self.dribble_min_distance:
+            return
+        path = list(holder["path"])
+        if path[-1] != as_loc(holder["location"]):
+            path.append(as_loc(holder["location"]))
+        self.possession["actions"].append({
+            "type": "dribble",
+            "player": holder["player"],
+            "player_number": holder["player"],
+            "start_frame": holder["start_frame"],
+            "end_frame": holder["last_frame"],
+            "start_location_m": as_loc(holder["start_location"]),
+            "end_location_m": as_loc(holder["location"]),
+            "path": path,
+        })
+
+# -------------------------------
+# possessions_*.json writer that is valid JSON after every write
+# -------------------------------
+class PossessionWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(b"[\n]")
+        self.file.flush()
+        self.count = 0
+
+    def write(self, possession):
+        # overwrite the closing bracket, so the GUI can reload the file while a match is running
+        self.file.seek(-1, os.SEEK_END)
+        prefix = b",\n" if self.count else b""
+        self.file.write(prefix + json.dumps(possession).encode() + b"\n]")
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,150 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from tracking_france_usa_withlimitedid import (
+    CLS_COL, ID_POOL_SIZES, DetectionCache, assign_ids, build_id_pools, detection_cache_path, get_group_lut,
+    load_profile,
+)
+
+# -------------------------------
+# open a complete detection cache for replay
+# -------------------------------
+def open_replay_cache(path):
+    cache = DetectionCache(path)
+    if not cache.replay:
+        raise ValueError(f"{path} is not a complete detection cache, run the tracker with --detection-cache first")
+    return cache
+
+def load_frames(cache):
+    # every detected frame as (frame number, rows, tracked detections), the rows stay float32 slices of the
+    # memory-mapped cache (assign_ids makes its own int copy per frame); frames the stride skipped are left
+    # out, exactly as track_batch never calls assign_ids for them
+    lut = get_group_lut(cache.names)
+    frames = []
+    for frame_count, (start, count) in enumerate(cache.index.tolist(), 1):
+        if count < 0:
+            continue
+        frame_rows = cache.rows[start:start + count]
+        frames.append((frame_count, frame_rows, int((lut[frame_rows[:, CLS_COL].astype(int)] >= 0).sum())))
+    return frames
+
+# -------------------------------
+# re-run the id assignment policy on cached raw tracks
+# -------------------------------
+def replay(frames, names, delay_frames=10, pool_sizes=ID_POOL_SIZES, on_frame=None):
+    # same assign_ids as the live tracker, so a replay gives the ids a live run with these settings would give;
+    # on_frame(frame_count, tracks) receives the tracks of every detected frame
+    id_map = {}
+    lost_ids = OrderedDict()
+    available_ids = build_id_pools(pool_sizes)
+    unassigned = 0
+
+    start_time = time.perf_counter()
+    for frame_count, rows, tracked in frames:
+        tracks = assign_ids(rows, names, id_map, available_ids, lost_ids, delay_frames, frame_count)
+        # tracked detections that got no id because their group's pool was used up
+        unassigned += tracked - len(tracks)
+        if on_frame is not None:
+            on_frame(frame_count, tracks)
+    elapsed = time.perf_counter() - start_time
+
+    ids_assigned = {g_key: pool.acquired for g_key, pool in available_ids.items()}
+    return {
+        "delay_frames": delay_frames,
+        "id_pools": dict(pool_sizes),
+        "frames": frames[-1][0] if frames else 0,
+        "seconds": round(elapsed, 3),
+        "fps": round(len(frames) / max(elapsed, 1e-9), 1),
+        # every acquire is an object that shows up under a new number
+        "churn": sum(ids_assigned.values()),
+        "unassigned": unassigned,
+        "ids_assigned": ids_assigned,
+        "ids_released": {g_key: pool.released for g_key, pool in available_ids.items()},
+        "lost_at_end": len(lost_ids),
+    }
+
+# -------------------------------
+# parameter sweep over delay_frames and pool sizes in parallel processes
+# -------------------------------
+worker_frames = {}
+
+def replay_worker(cache_path, delay_frames, pool_sizes):
+    # each worker process loads the cache once and keeps it for the sweep points it gets
+    if cache_path not in worker_frames:
+        cache = open_replay_cache(cache_path)
+        worker_frames[cache_path] = (load_frames(cache), cache.names)
+    frames, names = worker_frames[cache_path]
+    return replay(frames, names, delay_frames, pool_sizes)
+
+def sweep_grid(delay_frames_values, pool_options, pool_sizes=ID_POOL_SIZES):
+    # pool_options maps a group to the sizes to try, groups not in it keep their size from pool_sizes
+    groups = list(pool_options)
+    grid = []
+    for delay_frames in delay_frames_values:
+        for sizes in itertools.product(*(pool_options[g_key] for g_key in groups)):
+            grid.append((delay_frames, dict(pool_sizes, **dict(zip(groups, sizes)))))
+    return grid
+
+def run_sweep(cache_path, grid, workers=None, rank_by=("unassigned", "churn")):
+    # results sorted best first
+    workers = min(workers or os.cpu_count() or 1, len(grid))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(replay_worker, cache_path, delay_frames, pool_sizes)
+                   for delay_frames, pool_sizes in grid]
+        results = [future.result() for future in futures]
+    return sorted(results, key=lambda result: tuple(result[key] for key in rank_by))
+
+def parse_pool_option(text):
+    # "france_players=10,11,12" -> ("france_players", [10, 11, 12])
+    g_key, _, sizes = text.partition("=")
+    return g_key, [int(size) for size in sizes.split(",")]
+
+# -------------------------------
+# Main Function
+# -------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay cached raw tracks and sweep the id assignment settings.")
+    parser.add_argument("cache", nargs="?", help="detection cache directory, defaults to the one of the profile's video")
+    parser.add_argument("--profile", help="JSON run profile, see tracking_profile.json")
+    parser.add_argument("--delay-frames", type=int, nargs="+", help="values to try, defaults to the profile's")
+    parser.add_argument("--pool", action="append", default=[], metavar="GROUP=N,M",
+                        help="pool sizes to try for one group, e.g. france_players=10,11")
+    parser.add_argument("--rank-by", choices=("churn", "unassigned"), default="unassigned",
+                        help="primary ranking metric, the other one breaks ties")
+    parser.add_argument("--out", help="write all results as JSON")
+    args = parser.parse_args(argv)
+
+    profile = load_profile(args.profile)
+    cache_path = args.cache
+    if cache_path is None:
+        if not profile["detection_cache"]:
+            parser.error("no cache given and the profile has no detection_cache")
+        cache_path = detection_cache_path(profile["detection_cache"], profile["video_path"], profile["model_path"],
+                                          profile["tracker_type"], profile["infer"])
+
+    grid = sweep_grid(args.delay_frames or [profile["delay_frames"]], dict(map(parse_pool_option, args.pool)),
+                      profile["id_pools"])
+    rank_by = (args.rank_by, "churn" if args.rank_by == "unassigned" else "unassigned")
+
+    start_time = time.perf_counter()
+    results = run_sweep(cache_path, grid, profile["workers"] or None, rank_by)
+    elapsed = time.perf_counter() - start_time
+
+    pool_groups = [parse_pool_option(option)[0] for option in args.pool]
+    for result in results:
+        pools = " ".join(f"{g_key}={result['id_pools'][g_key]}" for g_key in pool_groups)
+        print(f"delay_frames={result['delay_frames']:<4} {pools} | churn {result['churn']:>6} | "
+              f"unassigned {result['unassigned']:>7} | {result['fps']:.0f} fps")
+    print(f"{len(grid)} settings replayed in {elapsed:.1f}s")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import os
+import shutil
+import subprocess
+import time
+import cv2
+import numpy as np
+import torch
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from ultralytics import YOLO
+
+from tracking_france_usa_withlimitedid import (
+    GROUP_KEYS, ID_POOL_SIZES, INFER_OPTIONS, TrackInterpolator, build_id_pools, close_outputs, get_group_lut, load_homographies,
+    load_profile, open_capture, open_outputs, output_frame, read_batch, track_batch,
+)
+
+# -------------------------------
+# frame numbers of key frames, workers seek to them so seeking is cheap and frame exact
+# -------------------------------
+def keyframe_indices(video_path, fps):
+    if shutil.which("ffprobe") is None:
+        return []
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=start_time:packet=pts_time,flags",
+         "-of", "csv", video_path],
+        capture_output=True, text=True,
+    ).stdout
+
+    # lines are "stream,start_time" and "packet,pts_time,flags"
+    start_time = 0.0
+    key_times = []
+    for line in out.splitlines():
+        section, _, fields = line.partition(",")
+        if section == "stream":
+            value = fields.partition(",")[0]
+            if value not in ("", "N/A"):
+                start_time = float(value)
+        elif section == "packet":
+            pts_time, _, flags = fields.partition(",")
+            if "K" in flags and pts_time not in ("", "N/A"):
+                key_times.append(float(pts_time))
+    # pts count from the stream's first pts, OpenCV frame numbers from 0
+    return sorted({round((pts_time - start_time) * fps) for pts_time in key_times})
+
+# -------------------------------
+# split the video into one segment per worker
+# -------------------------------
+def plan_segments(video_path, workers, overlap=25):
+    # returns (warmup_start, start, end): frames warmup_start..start-1 are also tracked by the previous
+    # segment and are only used to warm up the tracker and to reconcile ids at the boundary; the worker
+    # seeks to warmup_start, so that is the frame put on a key frame
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    cap.release()
+
+    keyframes = keyframe_indices(video_path, fps)
+    starts = [(0, 0)]
+    for i in range(1, workers):
+        warmup_start = total * i // workers - overlap
+        if keyframes:
+            # nearest key frame at or before the even split point minus the overlap
+            warmup_start = max((k for k in keyframes if k <= warmup_start), default=0)
+        if warmup_start > starts[-1][1]:
+            starts.append((warmup_start, warmup_start + overlap))
+    ends = [start for _, start in starts[1:]] + [total]
+
+    return [(warmup_start, start, end) for (warmup_start, start), end in zip(starts, ends)]
+
+# -------------------------------
+# segment tracks as column arrays instead of one tuple per row
+# -------------------------------
+GROUP_INDEX = {g_key: i for i, g_key in enumerate(GROUP_KEYS)}
+
+def track_columns(frames, tracks):
+    # same columns as the track log without the pitch location, group is an index into GROUP_KEYS
+    return {
+        "frame": np.array(frames, dtype=np.int32),
+        "id": np.array([track[0] for track in tracks], dtype=np.uint16),
+        "group": np.array([GROUP_INDEX[track[1]] for track in tracks], dtype=np.uint8),
+        "bbox": np.array([track[3] for track in tracks], dtype=np.int32).reshape(-1, 4),
+    }
+
+def concat_columns(chunks):
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+def frame_rows(columns, first_frame, last_frame):
+    # row range of frames first_frame..last_frame, rows are in frame order
+    lo = int(np.searchsorted(columns["frame"], first_frame, side="left"))
+    hi = int(np.searchsorted(columns["frame"], last_frame, side="right"))
+    return lo, hi
+
+# -------------------------------
+# track one segment in a worker process
+# -------------------------------
+def track_segment(video_path, model_path, tracker_type, segment, delay_frames=10, pool_sizes=ID_POOL_SIZES,
+                  batch_size=8, infer_options=INFER_OPTIONS, workers=1, decode_threads=0, hw_accel=False):
+    warmup_start, start, end = segment
+    # torch defaults to one thread per core in every process, share the cores between the workers instead
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    model = YOLO(model_path)
+    get_group_lut(model.names)
+
+    cap = open_capture(video_path, decode_threads, hw_accel)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+
+    id_map = {}
+    lost_ids = OrderedDict()
+    available_ids = build_id_pools(pool_sizes)
+    interpolator = TrackInterpolator()
+
+    chunks = [track_columns([], [])]
+    frame_count = warmup_start
+
+    def add_rows(ready):
+        # one block of columns per batch
+        nonlocal frame_count
+        frames, tracks = [], []
+        for _, frame_tracks in ready:
+            frame_count += 1
+            frames += [frame_count] * len(frame_tracks)
+            tracks += frame_tracks
+        if tracks:
+            chunks.append(track_columns(frames, tracks))
+
+    frames_read = warmup_start
+    while frames_read < end:
+        frames = read_batch(cap, min(batch_size, end - frames_read))
+        if not frames:
+            break
+        tracks_list = track_batch(frames, model, tracker_type, id_map, available_ids, lost_ids, delay_frames,
+                                  frames_read, infer_options)
+        frames_read += len(frames)
+        # only the tracks are kept, not the frames
+        add_rows(interpolator.feed([None] * len(frames), tracks_list))
+    add_rows(interpolator.flush())
+
+    cap.release()
+    return segment, concat_columns(chunks)
+
+# -------------------------------
+# id reconciliation at segment boundaries
+# -------------------------------
+def box_iou(a, b):
+    x1 = max(a[0], b[0])
+    y1 = max(a[1], b[1])
+    x2 = min(a[2], b[2])
+    y2 = min(a[3], b[3])
+    inter = max(x2 - x1, 0) * max(y2 - y1, 0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def overlap_rows(columns, first_frame, last_frame):
+    # (frame, id, group, box) rows of the overlapping frames, only these few go through Python
+    lo, hi = frame_rows(columns, first_frame, last_frame)
+    return zip(*(columns[name][lo:hi].tolist() for name in ("frame", "id", "group", "bbox")))
+
+def reconcile_ids(prev_columns, columns, first_frame, last_frame, pool_sizes=ID_POOL_SIZES, min_iou=0.5):
+    # maps (group_key, local id) of the new segment to the ids the previous segment used for the
+    # same objects, judged by mean box IoU over the overlapping frames first_frame..last_frame
+    prev_boxes = defaultdict(dict)
+    for frame, assigned_id, group, box in overlap_rows(prev_columns, first_frame, last_frame):
+        prev_boxes[(frame, GROUP_KEYS[group])][assigned_id] = box
+
+    scores = defaultdict(list)
+    for frame, assigned_id, group, box in overlap_rows(columns, first_frame, last_frame):
+        g_key = GROUP_KEYS[group]
+        for prev_id, prev_box in prev_boxes[(frame, g_key)].items():
+            scores[(g_key, assigned_id, prev_id)].append(box_iou(box, prev_box))
+
+    mapping = {}
+    # every id the previous segment had on screen in the overlap stays reserved, matched or not,
+    # so an unmatched new id never takes the number of a player the previous segment still shows
+    reserved = {(g_key, assigned_id) for (_, g_key), boxes in prev_boxes.items() for assigned_id in boxes}
+    taken = set()
+    ranked = sorted(((sum(ious) / len(ious), key) for key, ious in scores.items()), reverse=True)
+    for mean_iou, (g_key, local_id, prev_id) in ranked:
+        if mean_iou < min_iou:
+            break
+        if (g_key, local_id) not in mapping and (g_key, prev_id) not in taken:
+            mapping[(g_key, local_id)] = prev_id
+            taken.add((g_key, prev_id))
+
+    # unmatched ids keep their own number when it is still free, otherwise the lowest free one of the group
+    pools = build_id_pools(pool_sizes)
+    segment_ids = np.unique(np.stack([columns["group"], columns["id"]], axis=1), axis=0).tolist()
+    local_ids = sorted({(GROUP_KEYS[group], assigned_id) for group, assigned_id in segment_ids} - mapping.keys())
+    taken |= reserved
+    for g_key, local_id in local_ids:
+        if (g_key, local_id) not in taken:
+            mapping[(g_key, local_id)] = local_id
+            taken.add((g_key, local_id))
+    for g_key, local_id in local_ids:
+        if mapping.get((g_key, local_id)) is None:
+            free = [i for i in sorted(pools[g_key].free) if (g_key, i) not in taken]
+            if not free:
+                # more ids in play than the pool holds, fall back to a reserved id this segment does not use
+                used = {assigned_id for (group, _), assigned_id in mapping.items() if group == g_key}
+                free = [i for i in sorted(pools[g_key].free) if i not in used]
+            mapping[(g_key, local_id)] = free[0]
+            taken.add((g_key, free[0]))
+    return mapping
+
+def stitch_segments(results, pool_sizes=ID_POOL_SIZES):
+    # results: (segment, columns) in segment order; returns one set of columns with globally consistent ids
+    stitched = []
+    prev_columns = None
+    for (warmup_start, start, end), columns in results:
+        if prev_columns is not None and warmup_start < start:
+            mapping = reconcile_ids(prev_columns, columns, warmup_start + 1, start, pool_sizes)
+            # the mapping as a table indexed by group and local id, applied to the whole id column at once
+            lut = np.zeros((len(GROUP_KEYS), int(columns["id"].max(initial=0)) + 1), dtype=columns["id"].dtype)
+            for (g_key, local_id), assigned_id in mapping.items():
+                lut[GROUP_INDEX[g_key], local_id] = assigned_id
+            columns = dict(columns, id=lut[columns["group"], columns["id"]])
+        first = frame_rows(columns, start + 1, end)[0]
+        stitched.append({name: column[first:] for name, column in columns.items()})
+        prev_columns = columns
+    return concat_columns(stitched)
+
+# -------------------------------
+# run all segments in parallel
+# -------------------------------
+def run_sharded(video_path, model_path, tracker_type, workers=None, overlap=25, delay_frames=10,
+                pool_sizes=ID_POOL_SIZES, batch_size=8, infer_options=INFER_OPTIONS, decode_threads=0, hw_accel=False):
+    workers = workers or os.cpu_count() or 1
+    segments = plan_segments(video_path, workers, overlap)
+
+    with ProcessPoolExecutor(max_workers=len(segments)) as executor:
+        futures = [executor.submit(track_segment, video_path, model_path, tracker_type, segment, delay_frames,
+                                   pool_sizes, batch_size, infer_options, len(segments), decode_threads, hw_accel)
+                   for segment in segments]
+        results = [future.result() for future in futures]
+
+    return stitch_segments(results, pool_sizes)
+
+# -------------------------------
+# Main Function
+# -------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Track one match video in parallel segments.")
+    parser.add_argument("--profile", help="JSON run profile, see tracking_profile.json")
+    parser.add_argument("--overlap", type=int, default=25, help="frames tracked by both neighbouring segments")
+    args = parser.parse_args(argv)
+
+    profile = load_profile(args.profile)
+    out = profile["outputs"]
+    video_path = profile["video_path"]
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    tracks_out = out["tracks_out"] or f"{name}_tracks.csv"
+    track_log = out["track_log"] or f"{name}_tracks"
+    homography_file = out["homographies"]
+    workers = profile["workers"] or os.cpu_count()
+    overlap = args.overlap
+
+    start_time = time.perf_counter()
+    columns = run_sharded(video_path, profile["model_path"], profile["tracker_type"], workers, overlap,
+                          profile["delay_frames"], profile["id_pools"], profile["batch_size"], profile["infer"],
+                          profile["decode_threads"], profile["hw_accel"])
+    elapsed = time.perf_counter() - start_time
+
+    # same track outputs as the single process tracker, no frames to show or write
+    homographies = load_homographies(homography_file) if homography_file else None
+    outputs = open_outputs(tracks_out=tracks_out, track_log=track_log, homographies=homographies)
+    frame_numbers = columns["frame"]
+    # first row of every frame, only one frame at a time is turned back into tuples
+    firsts = np.flatnonzero(np.diff(frame_numbers, prepend=-1)).tolist()
+    for lo, hi in zip(firsts, firsts[1:] + [len(frame_numbers)]):
+        tracks = [(assigned_id, GROUP_KEYS[group], None, tuple(box)) for assigned_id, group, box in
+                  zip(columns["id"][lo:hi].tolist(), columns["group"][lo:hi].tolist(), columns["bbox"][lo:hi].tolist())]
+        output_frame(None, tracks, int(frame_numbers[lo]), {}, outputs)
+    close_outputs(outputs)
+
+    frames = int(frame_numbers[-1]) if len(frame_numbers) else 0
+    print(f"{frames} frames on {workers} workers in {elapsed:.1f}s ({frames / max(elapsed, 1e-9):.1f} fps)")
+
+if __name__ == "__main__":
+    main()
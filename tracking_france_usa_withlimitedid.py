@@ -1,6 +1,86 @@
+import argparse
+import bisect
+import copy
+import csv
+import gc
+import hashlib
+import heapq
+import json
+import os
+import time
+import queue
+import sys
+import threading
 import cv2
+import numpy as np
 from ultralytics import YOLO
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
+
+from possession_engine import PossessionEngine, PossessionWriter
+
+# -------------------------------
+# per-stage timing: rolling p50/p95/p99 per stage and a live fps estimate
+# -------------------------------
+class StageTimes:
+    def __init__(self, window=1000):
+        self.window = window  # samples kept per stage for the rolling percentiles
+        self.lock = threading.Lock()  # stages are recorded from the decode, infer and render threads
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+            self.totals = defaultdict(float)
+            self.counts = defaultdict(int)
+            self.frame_ends = deque(maxlen=self.window)
+
+    def add(self, stage, seconds, frames=1):
+        # batched stages are recorded once per batch as time per frame
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+            self.samples[stage].append(seconds / frames)
+            self.totals[stage] += seconds
+            self.counts[stage] += frames
+
+    def frame_done(self):
+        with self.lock:
+            self.frame_ends.append(time.perf_counter())
+
+    def fps(self):
+        with self.lock:
+            if len(self.frame_ends) < 2:
+                return 0.0
+            return (len(self.frame_ends) - 1) / max(self.frame_ends[-1] - self.frame_ends[0], 1e-9)
+
+    def summary(self):
+        with self.lock:
+            samples = {stage: np.array(values) * 1000 for stage, values in self.samples.items()}
+            totals, counts = dict(self.totals), dict(self.counts)
+        return {
+            stage: {
+                "frames": counts[stage],
+                "total_s": round(totals[stage], 3),
+                "mean_ms": round(totals[stage] * 1000 / max(counts[stage], 1), 3),
+                "p50_ms": round(float(np.percentile(values, 50)), 3),
+                "p95_ms": round(float(np.percentile(values, 95)), 3),
+                "p99_ms": round(float(np.percentile(values, 99)), 3),
+            }
+            for stage, values in samples.items()
+        }
+
+    def write_report(self, path):
+        # CSV for .csv paths, JSON otherwise
+        summary = self.summary()
+        with open(path, "w", newline="") as f:
+            if path.endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(("stage", "frames", "total_s", "mean_ms", "p50_ms", "p95_ms", "p99_ms"))
+                writer.writerows((stage, *row.values()) for stage, row in summary.items())
+            else:
+                json.dump({"fps": round(self.fps(), 2), "stages": summary}, f, indent=2)
+
+stage_times = StageTimes()
 
 # -------------------------------
 # indicate name of group based on each class
@@ -21,37 +101,277 @@ def get_group_key(class_name):
         return "ball"
     return None
 
+# -------------------------------
+# class id -> group index lookup table, built once per model
+# -------------------------------
+GROUP_KEYS = ("france_players", "USA_players", "refs", "USA_GK", "france_GK", "ball")
+
+def build_group_lut(names):
+    # -1 marks classes that are not tracked
+    lut = np.full(max(names) + 1, -1, dtype=np.int8)
+    for cls, class_name in names.items():
+        group_key = get_group_key(class_name)
+        if group_key is not None:
+            lut[cls] = GROUP_KEYS.index(group_key)
+    return lut
+
+group_luts = {}
+
+def get_group_lut(names):
+    cached = group_luts.get(id(names))
+    if cached is None or cached[0] is not names:
+        cached = (names, build_group_lut(names))
+        group_luts[id(names)] = cached
+    return cached[1]
+
+# -------------------------------
+# pool of fixed ids for one group, always hands out the lowest free id
+# -------------------------------
+class IDPool:
+    def __init__(self, ids):
+        self.free = list(ids)
+        heapq.heapify(self.free)
+        # churn counters for run summaries
+        self.acquired = 0
+        self.released = 0
+
+    def __len__(self):
+        return len(self.free)
+
+    def acquire(self):
+        if not self.free:
+            return None
+        self.acquired += 1
+        return heapq.heappop(self.free)
+
+    def release(self, assigned_id):
+        self.released += 1
+        heapq.heappush(self.free, assigned_id)
+
+    def take(self, assigned_id):
+        # hands out one specific free id (re-identification), False if it is not free
+        try:
+            index = self.free.index(assigned_id)
+        except ValueError:
+            return False
+        self.free[index] = self.free[-1]
+        self.free.pop()
+        heapq.heapify(self.free)
+        self.acquired += 1
+        return True
+
+# default squad layout: france_players 1-10, USA_players 11-20, refs 21-23, USA_GK 24, france_GK 25, ball 26
+ID_POOL_SIZES = {
+    "france_players": 10,
+    "USA_players": 10,
+    "refs": 3,
+    "USA_GK": 1,
+    "france_GK": 1,
+    "ball": 1,
+}
+
+def build_id_pools(pool_sizes=ID_POOL_SIZES, first_id=1):
+    # consecutive id ranges in the order of pool_sizes
+    pools = {}
+    for group_key, size in pool_sizes.items():
+        pools[group_key] = IDPool(range(first_id, first_id + size))
+        first_id += size
+    return pools
+
+GROUP_COLORS = {
+    "USA_players": (0, 165, 255),
+    "france_players": (255, 0, 255),
+    "refs": (0, 255, 0),
+    "ball": (255, 0, 0),
+    "USA_GK": (0, 255, 255),
+    "france_GK": (0, 0, 255),
+}
+
+# -------------------------------
+# label sprites, rendered once per (id, class, color) and blitted afterwards
+# -------------------------------
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_HEIGHT = 11  # label bar spans y1 - 10 .. y1
+
+label_sprites = {}
+
+def get_label_sprite(assigned_id, class_name, color):
+    key = (assigned_id, class_name, color)
+    sprite = label_sprites.get(key)
+    if sprite is None:
+        text = f"ID {assigned_id} | {class_name}"
+        (text_w, text_h), _ = cv2.getTextSize(text, LABEL_FONT, 0.4, 1)
+        sprite = np.empty((LABEL_HEIGHT, text_w + 1, 3), dtype=np.uint8)
+        sprite[:] = color
+        cv2.putText(sprite, text, (0, LABEL_HEIGHT - 3), LABEL_FONT, 0.4, (0, 0, 0), 1)
+        label_sprites[key] = sprite
+    return sprite
+
+def blit(frame, sprite, x, y):
+    # copy sprite with its top-left corner at (x, y), clipped to the frame
+    h, w = frame.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sprite.shape[1], w), min(y + sprite.shape[0], h)
+    if x0 < x1 and y0 < y1:
+        frame[y0:y1, x0:x1] = sprite[y0 - y:y1 - y, x0 - x:x1 - x]
+
 # -------------------------------
 # draw box and id 
 # -------------------------------
 def draw_box(frame, x1, y1, x2, y2, assigned_id, class_name, color):
     cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-    text = f"ID {assigned_id} | {class_name}"
-    (text_w, text_h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)
-    cv2.rectangle(frame, (x1, y1 - 10), (x1 + text_w, y1), color, -1)
-    cv2.putText(frame, text, (x1, y1 - 2),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
+    blit(frame, get_label_sprite(assigned_id, class_name, color), x1, y1 - LABEL_HEIGHT + 1)
 
 # -------------------------------
-# process each frame 
+# pull tracker output to host memory
 # -------------------------------
-def process_frame(frame, model, tracker_type, id_map, available_ids, colors, lost_ids, delay_frames, frame_count):
-    results = model.track(frame, tracker=tracker_type, persist=True)
+# column layout of result.boxes.data while tracking
+BOX_COLS = slice(0, 4)
+ID_COL = 4
+CONF_COL = 5
+CLS_COL = 6
+
+def extract_detections(result, scale=1.0):
+    # one device->host copy per frame, everything downstream works on views of this array
+    if result.boxes.id is None:
+        return None
+    detections = result.boxes.data.cpu().numpy()
+    if scale != 1.0:
+        # boxes back to source resolution
+        detections[:, BOX_COLS] /= scale
+    return detections
+
+# -------------------------------
+# appearance store for re-identification after a track was lost
+# -------------------------------
+# ring colour histograms kept per assigned id, update_every frames between two samples of the same id,
+# max_distance Bhattacharyya distance that still counts as the same person, max_speed pixels per frame
+# a player can move while gone (gates candidates by position)
+REID_OPTIONS = {"enabled": False, "ring": 8, "update_every": 5, "max_distance": 0.3, "max_speed": 20}
+
+HIST_BINS = (16, 4)  # hue x saturation
+HIST_SIZE = HIST_BINS[0] * HIST_BINS[1]
+
+class AppearanceStore:
+    def __init__(self, max_id, reid_options=REID_OPTIONS):
+        ring = reid_options.get("ring", 8)
+        self.update_every = reid_options.get("update_every", 5)
+        self.max_distance = reid_options.get("max_distance", 0.3)
+        self.max_speed = reid_options.get("max_speed", 20)
+
+        # fixed size for the whole run: ids are bounded by the pools, samples by the ring
+        self.embeddings = np.zeros((max_id + 1, ring, HIST_SIZE), dtype=np.float32)
+        self.samples = np.zeros(max_id + 1, dtype=int)  # samples ever written, ring slot = samples % ring
+        self.centers = np.zeros((max_id + 1, 2), dtype=np.float32)
+        self.last_seen = np.full(max_id + 1, -1, dtype=int)
+        self.last_sample = np.full(max_id + 1, -1, dtype=int)
+        self.matched = 0
 
+    def embed(self, frame, box):
+        # square-rooted, normalised hue/saturation histogram of the torso, so a dot product is the
+        # Bhattacharyya coefficient; shorts, socks and grass below the waist are left out
+        x1, y1, x2, y2 = box
+        h = y2 - y1
+        crop = frame[max(y1 + h // 6, 0):max(y1 + h // 2, 0), max(x1, 0):max(x2, 0)]
+        if crop.size == 0:
+            return None
+        hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1], None, HIST_BINS, [0, 180, 0, 256]).ravel()
+        total = hist.sum()
+        return np.sqrt(hist / total) if total else None
+
+    def reset(self, assigned_id):
+        self.samples[assigned_id] = 0
+
+    def observe(self, frame, tracks, frame_count):
+        for assigned_id, g_key, _, box in tracks:
+            if g_key == "ball":
+                continue
+            self.centers[assigned_id] = ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)
+            self.last_seen[assigned_id] = frame_count
+            if self.samples[assigned_id] and frame_count - self.last_sample[assigned_id] < self.update_every:
+                continue
+            embedding = self.embed(frame, box)
+            if embedding is not None:
+                ring = self.embeddings[assigned_id]
+                ring[self.samples[assigned_id] % len(ring)] = embedding
+                self.samples[assigned_id] += 1
+                self.last_sample[assigned_id] = frame_count
+
+    def match(self, frame, box, candidate_ids, frame_count):
+        # nearest stored appearance among candidate_ids, None if nothing is close enough
+        candidates = np.array([i for i in candidate_ids if self.samples[i]], dtype=int)
+        if not len(candidates):
+            return None
+        center = np.array(((box[0] + box[2]) / 2, (box[1] + box[3]) / 2), dtype=np.float32)
+        gone = frame_count - self.last_seen[candidates]
+        reachable = np.hypot(*(self.centers[candidates] - center).T) <= self.max_speed * (gone + 1)
+        candidates = candidates[reachable]
+        if not len(candidates):
+            return None
+        embedding = self.embed(frame, box)
+        if embedding is None:
+            return None
+
+        # [C, ring] coefficients against every sample, unwritten slots never win
+        coefficients = self.embeddings[candidates] @ embedding
+        filled = np.arange(coefficients.shape[1]) < self.samples[candidates, None]
+        best = np.where(filled, coefficients, -1).max(axis=1)
+        nearest = int(best.argmax())
+        if 1 - best[nearest] > self.max_distance:
+            return None
+        self.matched += 1
+        return int(candidates[nearest])
+
+    def assign(self, frame, box, group_key, pool, lost_ids, frame_count):
+        # id for a tracker key seen for the first time: the id of the best matching lost track of the group,
+        # else the best matching released id, else the free id that has been unseen the longest (so ids of
+        # players still off screen are handed out last), with its old appearance dropped
+        lost = {assigned_id: key for key, ((assigned_id, g_key), _) in lost_ids.items() if g_key == group_key}
+        assigned_id = self.match(frame, box, list(lost) + list(pool.free), frame_count)
+        if assigned_id is not None:
+            if assigned_id in lost:
+                del lost_ids[lost[assigned_id]]
+                return assigned_id
+            if pool.take(assigned_id):
+                return assigned_id
+        if not pool:
+            return None
+        assigned_id = min(pool.free, key=lambda i: (self.last_seen[i], i))
+        pool.take(assigned_id)
+        self.reset(assigned_id)
+        return assigned_id
+
+# -------------------------------
+# assign fixed ids for one tracker result
+# -------------------------------
+def assign_ids(detections, names, id_map, available_ids, lost_ids, delay_frames, frame_count, reid=None, frame=None):
+    # reid (an AppearanceStore) with the frame re-identifies new tracker keys by appearance
+    tracks = []
     current_keys = set()
 
-    if results[0].boxes.id is not None:
-        track_ids = results[0].boxes.id.cpu().numpy().astype(int)
-        boxes = results[0].boxes.xyxy.cpu().numpy()
-        classes = results[0].boxes.cls.cpu().numpy().astype(int)
+    if detections is not None:
+        # single integer copy of the frame, the columns below are views into it
+        rows = detections.astype(int)
+
+        # map the whole frame to groups at once and drop non-tracked classes before the loop
+        groups = get_group_lut(names)[rows[:, CLS_COL]]
+        tracked = groups >= 0
+        if not tracked.all():
+            rows, groups = rows[tracked], groups[tracked]
 
-        for box, track_id, cls in zip(boxes, track_ids, classes):
-            x1, y1, x2, y2 = map(int, box)
-            class_name = model.names[int(cls)]
-            group_key = get_group_key(class_name)
+        boxes = rows[:, BOX_COLS].tolist()
+        track_ids = rows[:, ID_COL].tolist()
+        classes = rows[:, CLS_COL].tolist()
+
+        for (x1, y1, x2, y2), track_id, cls, group in zip(boxes, track_ids, classes, groups.tolist()):
+            class_name = names[cls]
+            group_key = GROUP_KEYS[group]
             key = (class_name, track_id)
 
-            if group_key:
+            pool = available_ids.get(group_key)
+
+            if pool is not None:
                 current_keys.add(key)
 
                 
@@ -61,89 +381,1223 @@ def process_frame(frame, model, tracker_type, id_map, available_ids, colors, los
                         assigned_id, g_key = lost_ids[key][0]
                         id_map[key] = (assigned_id, g_key)
                         del lost_ids[key]
-                    elif available_ids[group_key]:
-                        assigned_id = available_ids[group_key].pop(0)
+                    elif reid is not None and frame is not None and group_key != "ball":
+                        assigned_id = reid.assign(frame, (x1, y1, x2, y2), group_key, pool, lost_ids, frame_count)
+                        if assigned_id is None:
+                            continue
+                        id_map[key] = (assigned_id, group_key)
+                    elif pool:
+                        assigned_id = pool.acquire()
                         id_map[key] = (assigned_id, group_key)
                     else:
                         continue 
 
                 assigned_id, g_key = id_map[key]
-                color = colors.get(g_key, (255, 255, 255))
-                draw_box(frame, x1, y1, x2, y2, assigned_id, class_name, color)
+                tracks.append((assigned_id, g_key, class_name, (x1, y1, x2, y2)))
 
 
-    to_remove = []
-    for key, (assigned_id, g_key) in id_map.items():
-        if key not in current_keys:
-         
-            lost_ids[key] = ((assigned_id, g_key), frame_count)
-            to_remove.append(key)
+    # lost_ids is kept in the order tracks were lost, which is also their expiry order
+    # because every entry expires delay_frames after it was lost
+    for key in id_map.keys() - current_keys:
+        lost_ids.pop(key, None)
+        lost_ids[key] = (id_map.pop(key), frame_count)
 
-    for key in to_remove:
-        del id_map[key]
+    # only the oldest entries can have expired
+    while lost_ids:
+        key = next(iter(lost_ids))
+        (assigned_id, g_key), last_frame = lost_ids[key]
+        if frame_count - last_frame <= delay_frames:
+            break
+        available_ids[g_key].release(assigned_id)
+        del lost_ids[key]
 
-  
-    to_free = []
-    for key, ((assigned_id, g_key), last_frame) in lost_ids.items():
-        if frame_count - last_frame > delay_frames:
-            available_ids[g_key].append(assigned_id)
-            available_ids[g_key] = sorted(available_ids[g_key])
-            to_free.append(key)
+    return tracks
 
-    for key in to_free:
-        del lost_ids[key]
+# -------------------------------
+# draw all tracks of one frame
+# -------------------------------
+def draw_tracks(frame, tracks, colors):
+    # all rectangles of one color in a single polylines call, then the cached labels on top
+    outlines = defaultdict(list)
+    for assigned_id, g_key, class_name, (x1, y1, x2, y2) in tracks:
+        outlines[colors.get(g_key, (255, 255, 255))].append(((x1, y1), (x2, y1), (x2, y2), (x1, y2)))
+
+    for color, boxes in outlines.items():
+        cv2.polylines(frame, np.array(boxes, dtype=np.int32), True, color, 2)
 
+    for assigned_id, g_key, class_name, (x1, y1, x2, y2) in tracks:
+        color = colors.get(g_key, (255, 255, 255))
+        blit(frame, get_label_sprite(assigned_id, class_name, color), x1, y1 - LABEL_HEIGHT + 1)
     return frame
 
+# -------------------------------
+# process each frame 
+# -------------------------------
+def process_frame(frame, model, tracker_type, id_map, available_ids, colors, lost_ids, delay_frames, frame_count):
+    results = model.track(frame, tracker=tracker_type, persist=True)
+    tracks = assign_ids(extract_detections(results[0]), model.names, id_map, available_ids, lost_ids, delay_frames, frame_count)
+    return draw_tracks(frame, tracks, colors)
 
 # -------------------------------
-# Main Function
+# per-video handle on a model loaded once
 # -------------------------------
-def main():
-    model_path = "OD_YOLO11_V2.pt"
-    video_path = "france_usa_final.mp4"
-    tracker_type = "botsort_custom.yaml"
+def model_view(model):
+    # shares the loaded weights, but gets its own predictor (and with it its own tracker) and callbacks,
+    # so persist=True tracking state never leaks from one video into another
+    view = copy.copy(model)
+    view.predictor = None
+    view.callbacks = {event: list(funcs) for event, funcs in model.callbacks.items()}
+    return view
 
-    model = YOLO(model_path)
-    cap = cv2.VideoCapture(video_path)
+# -------------------------------
+# ball path: small crop around the predicted ball position on every frame
+# -------------------------------
+# roi_size is the crop side in source pixels and the detector input size, so the ball is seen at native
+# resolution instead of shrunk with the whole frame; the crop is searched only while the full-frame detection
+# misses the ball, and given up after max_misses frames until the full-frame detection finds it again
+BALL_OPTIONS = {"enabled": False, "roi_size": 320, "max_misses": 15, "conf": 0.1}
 
-    id_map = {}
-    lost_ids = {}  
-    frame_count = 0
-    delay_frames = 10  
-    available_ids = {
-        "france_players": list(range(1, 11)),
-        "USA_players": list(range(11, 21)),
-        "refs": [21, 22, 23],
-        "USA_GK": [24],
-        "france_GK": [25],
-        "ball": [26]
-    }
+class BallTracker:
+    def __init__(self, model, ball_options=BALL_OPTIONS, device=None):
+        # its own predictor, detections of the crops must not reach the player tracker's callbacks
+        self.model = model_view(model)
+        self.roi_size = ball_options.get("roi_size", 320)
+        self.max_misses = ball_options.get("max_misses", 15)
+        self.conf = ball_options.get("conf", 0.1)
+        self.device = device
+        self.classes = np.flatnonzero(get_group_lut(model.names) == GROUP_KEYS.index("ball")).tolist()
 
-    colors = {
-        "USA_players": (0, 165, 255),  
-        "france_players": (255, 0, 255), 
-        "refs": (0, 255, 0), 
-        "ball": (255, 0, 0),  
-        "USA_GK": (0, 255, 255),  
-        "france_GK": (0, 0, 255) 
-    }
+        self.center = None
+        self.velocity = np.zeros(2, dtype=np.float32)
+        self.size = None
+        self.misses = 0
+        self.track = None  # (assigned_id, g_key, class_name) of the last full-frame ball detection
+        self.searched = 0
+        self.found = 0
+
+    def observe(self, box):
+        center = np.array(((box[0] + box[2]) / 2, (box[1] + box[3]) / 2), dtype=np.float32)
+        if self.center is not None and self.misses <= self.max_misses:
+            # velocity over the frames since the last sighting
+            self.velocity = (center - self.center) / (self.misses + 1)
+        self.center = center
+        self.size = (box[2] - box[0], box[3] - box[1])
+        self.misses = 0
+
+    def miss(self):
+        self.center = self.center + self.velocity
+        self.misses += 1
+
+    def search(self, frame):
+        # best ball box inside the crop around the predicted position, in frame coordinates
+        self.searched += 1
+        h, w = frame.shape[:2]
+        half = self.roi_size // 2
+        x0 = int(min(max(self.center[0] - half, 0), max(w - self.roi_size, 0)))
+        y0 = int(min(max(self.center[1] - half, 0), max(h - self.roi_size, 0)))
+        crop = frame[y0:y0 + self.roi_size, x0:x0 + self.roi_size]
+
+        kwargs = {"device": self.device} if self.device is not None else {}
+        result = self.model.predict(crop, imgsz=self.roi_size, conf=self.conf, classes=self.classes, verbose=False,
+                                    **kwargs)[0]
+        rows = result.boxes.data.cpu().numpy()
+        rows = rows[np.isin(rows[:, -1].astype(int), self.classes)]
+        if not len(rows):
+            return None
+        x1, y1, x2, y2 = rows[rows[:, -2].argmax(), :4]
+        self.found += 1
+        return int(x1) + x0, int(y1) + y0, int(x2) + x0, int(y2) + y0
+
+    def update(self, frames, tracks_list):
+        # adds the ball to frames whose full-frame detection missed it, skipped frames get a PartialTracks
+        for i, frame in enumerate(frames):
+            tracks = tracks_list[i]
+            ball = next((track for track in tracks if track[1] == "ball"), None) if tracks is not None else None
+            if ball is not None:
+                self.track = ball[:3]
+                self.observe(ball[3])
+                continue
+            if self.track is None or self.center is None or self.misses > self.max_misses or frame is None:
+                continue
+
+            box = self.search(frame)
+            if box is None:
+                self.miss()
+                continue
+            self.observe(box)
+            ball = (*self.track, box)
+            if tracks is None:
+                tracks_list[i] = PartialTracks([ball])
+            else:
+                tracks.append(ball)
+        return tracks_list
+
+# -------------------------------
+# track a batch of consecutive frames
+# -------------------------------
+# scale < 1 runs detection and tracking on a downscaled copy, imgsz overrides the model input size,
+# stride k detects only every k-th frame (the others are interpolated by TrackInterpolator),
+# device selects the inference device ("cpu", "0", ...), None lets Ultralytics pick
+INFER_OPTIONS = {"scale": 1.0, "imgsz": None, "stride": 1, "device": None}
+
+def downscale(frame, scale):
+    return cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+def track_batch(frames, model, tracker_type, id_map, available_ids, lost_ids, delay_frames, frame_count,
+                infer_options=INFER_OPTIONS, cache=None, ball_tracker=None, reid=None, long_run=None):
+    # returns the tracks of every frame, None for frames skipped by the stride;
+    # a replaying cache supplies the raw tracker output instead of the model, a recording one stores it;
+    # ball_tracker fills in the ball where the full-frame detection lost it, reid keeps ids across long losses,
+    # long_run (a LongRunGuard) caps and compacts the state that grows over a match
+    if long_run is not None:
+        long_run.step(frame_count, model, lost_ids, available_ids, reid)
+    scale = infer_options.get("scale", 1.0)
+    stride = infer_options.get("stride", 1)
+    track_kwargs = {key: infer_options[key] for key in ("imgsz", "device") if infer_options.get(key) is not None}
+
+    # frame numbers stay real frame numbers, so delay_frames means the same at any stride
+    detect_at = [i for i in range(len(frames)) if (frame_count + i) % stride == 0]
+    tracks_list = [None] * len(frames)
+    if cache is not None:
+        cache.seen = frame_count + len(frames)
+    if not detect_at:
+        return track_ball(frames, tracks_list, ball_tracker)
+
+    if cache is not None and cache.replay:
+        start = time.perf_counter()
+        for i in detect_at:
+            tracks_list[i] = assign_ids(cache.get(frame_count + i + 1), model.names, id_map, available_ids, lost_ids,
+                                        delay_frames, frame_count + i + 1, reid, frames[i])
+            observe_appearance(reid, frames[i], tracks_list[i], frame_count + i + 1)
+        stage_times.add("assign", time.perf_counter() - start, len(detect_at))
+        return track_ball(frames, tracks_list, ball_tracker)
+
+    start = time.perf_counter()
+    inputs = [frames[i] if scale == 1.0 else downscale(frames[i], scale) for i in detect_at]
+    if scale != 1.0:
+        stage_times.add("downscale", time.perf_counter() - start, len(detect_at))
+
+    # one detector call for the whole batch; the tracker still updates frame by frame in order
+    start = time.perf_counter()
+    results = model.track(inputs, tracker=tracker_type, persist=True, verbose=False, **track_kwargs)
+    stage_times.add("track", time.perf_counter() - start, len(detect_at))
+
+    extract_s = assign_s = 0.0
+    for i, result in zip(detect_at, results):
+        start = time.perf_counter()
+        detections = extract_detections(result, scale)
+        if cache is not None:
+            cache.put(frame_count + i + 1, detections)
+        extracted = time.perf_counter()
+        tracks_list[i] = assign_ids(detections, model.names, id_map, available_ids, lost_ids, delay_frames,
+                                    frame_count + i + 1, reid, frames[i])
+        observe_appearance(reid, frames[i], tracks_list[i], frame_count + i + 1)
+        extract_s += extracted - start
+        assign_s += time.perf_counter() - extracted
+    stage_times.add("extract", extract_s, len(detect_at))
+    stage_times.add("assign", assign_s, len(detect_at))
+    return track_ball(frames, tracks_list, ball_tracker)
+
+def observe_appearance(reid, frame, tracks, frame_count):
+    if reid is not None and frame is not None:
+        reid.observe(frame, tracks, frame_count)
+
+def track_ball(frames, tracks_list, ball_tracker):
+    if ball_tracker is None:
+        return tracks_list
+    start = time.perf_counter()
+    ball_tracker.update(frames, tracks_list)
+    stage_times.add("ball", time.perf_counter() - start, len(frames))
+    return tracks_list
+
+# -------------------------------
+# long-run mode: capped tracker / lost-track state, periodic compaction and a memory report per stage
+# -------------------------------
+# caps are per tracker; Ultralytics keeps removed tracks around for id bookkeeping only, and lost tracks
+# past max_lost_tracks are far older than anything the matcher would still revive
+LONG_RUN_OPTIONS = {
+    "enabled": False,
+    "compact_every": 1500,  # frames between two compactions
+    "max_removed_tracks": 100,
+    "max_lost_tracks": 200,
+    "max_lost_ids": 64,  # lost_ids entries beyond this are released early, oldest first
+    "report_every": 15000,  # frames between two memory reports, 0 = only at the end
+}
+
+def rss_mb():
+    # current resident set size where /proc is available, peak RSS otherwise, 0 where neither exists
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def array_bytes(obj):
+    # numpy payload of one object's attributes, deques of arrays included (track features)
+    total = 0
+    for value in vars(obj).values():
+        if isinstance(value, np.ndarray):
+            total += value.nbytes
+        elif isinstance(value, deque):
+            total += sum(item.nbytes for item in value if isinstance(item, np.ndarray))
+    return total
+
+class LongRunGuard:
+    # called from track_batch on the inference thread, the only thread that touches the tracker state
+    def __init__(self, long_run_options=LONG_RUN_OPTIONS):
+        self.compact_every = long_run_options.get("compact_every", 1500)
+        self.max_removed_tracks = long_run_options.get("max_removed_tracks", 100)
+        self.max_lost_tracks = long_run_options.get("max_lost_tracks", 200)
+        self.max_lost_ids = long_run_options.get("max_lost_ids", 64)
+        self.report_every = long_run_options.get("report_every", 15000)
+        self.next_compaction = self.compact_every
+        self.next_report = self.report_every or None
+        self.compactions = 0
+        self.trimmed = defaultdict(int)
+        self.reports = []
+
+    def step(self, frame_count, model, lost_ids, available_ids, reid=None):
+        if frame_count >= self.next_compaction:
+            self.next_compaction += self.compact_every
+            self.compact(model, lost_ids, available_ids)
+        if self.next_report is not None and frame_count >= self.next_report:
+            self.next_report += self.report_every
+            print(format_memory_report(self.report(frame_count, model, lost_ids, reid)))
+
+    def compact(self, model, lost_ids, available_ids):
+        for tracker in getattr(model.predictor, "trackers", None) or []:
+            removed = tracker.removed_stracks
+            if len(removed) > self.max_removed_tracks:
+                self.trimmed["removed_tracks"] += len(removed) - self.max_removed_tracks
+                tracker.removed_stracks = removed[-self.max_removed_tracks:]
+            lost = tracker.lost_stracks
+            if len(lost) > self.max_lost_tracks:
+                self.trimmed["lost_tracks"] += len(lost) - self.max_lost_tracks
+                tracker.lost_stracks = sorted(lost, key=lambda track: track.end_frame)[-self.max_lost_tracks:]
+
+        # oldest first, like the regular expiry in assign_ids
+        while len(lost_ids) > self.max_lost_ids:
+            key = next(iter(lost_ids))
+            (assigned_id, g_key), _ = lost_ids.pop(key)
+            available_ids[g_key].release(assigned_id)
+            self.trimmed["lost_ids"] += 1
+
+        # track objects reference each other, collect the cycles now instead of whenever gc gets to it
+        gc.collect()
+        self.compactions += 1
+
+    def report(self, frame_count, model, lost_ids, reid=None):
+        stages = {}
+        trackers = getattr(model.predictor, "trackers", None) or []
+        if trackers:
+            lists = {name: [track for tracker in trackers for track in getattr(tracker, name)]
+                     for name in ("tracked_stracks", "lost_stracks", "removed_stracks")}
+            stages["tracker"] = {
+                **{name: len(tracks) for name, tracks in lists.items()},
+                "kb": round(sum(array_bytes(track) for tracks in lists.values() for track in tracks) / 1024, 1),
+            }
+        stages["lost_ids"] = {"entries": len(lost_ids)}
+        sprites = list(label_sprites.values())
+        stages["label_sprites"] = {"entries": len(sprites), "kb": round(sum(s.nbytes for s in sprites) / 1024, 1)}
+        stages["stage_times"] = {"samples": sum(len(samples) for samples in list(stage_times.samples.values()))}
+        if reid is not None:
+            stages["reid"] = {"kb": round(reid.embeddings.nbytes / 1024, 1)}
+
+        report = {
+            "frame": frame_count,
+            "rss_mb": round(rss_mb(), 1),
+            "compactions": self.compactions,
+            "trimmed": dict(self.trimmed),
+            "stages": stages,
+        }
+        self.reports.append(report)
+        return report
+
+def format_memory_report(report):
+    stages = " | ".join(f"{stage} " + " ".join(f"{key} {value}" for key, value in values.items())
+                        for stage, values in report["stages"].items())
+    return f"memory at frame {report['frame']}: rss {report['rss_mb']} MB | {stages}"
+
+# -------------------------------
+# stride mode: fill skipped frames by interpolating boxes per assigned id
+# -------------------------------
+def interpolate_tracks(start_tracks, end_tracks, count):
+    # tracks for the count frames strictly between two detected frames,
+    # only ids present in both detections are interpolated
+    start = {track[0]: track for track in start_tracks}
+    matched = [(start[track[0]], track) for track in end_tracks if track[0] in start]
+    if not matched:
+        return [[] for _ in range(count)]
+
+    start_boxes = np.array([s[3] for s, _ in matched], dtype=np.float32)
+    end_boxes = np.array([e[3] for _, e in matched], dtype=np.float32)
+    weights = (np.arange(1, count + 1, dtype=np.float32) / (count + 1))[:, None, None]
+    boxes = (start_boxes + (end_boxes - start_boxes) * weights).astype(int).tolist()
+
+    return [[(e[0], e[1], e[2], tuple(box)) for (_, e), box in zip(matched, frame_boxes)]
+            for frame_boxes in boxes]
+
+class PartialTracks(list):
+    # tracks found on a frame the stride skipped by a cheaper path (the ball crop),
+    # the interpolator fills in every other id
+    pass
+
+def merge_partial(tracks, partial):
+    if not partial:
+        return tracks
+    found = {track[0] for track in partial}
+    return [track for track in tracks if track[0] not in found] + list(partial)
+
+class TrackInterpolator:
+    def __init__(self):
+        self.last_tracks = []
+        self.pending = []  # (frame, partial tracks) of skipped frames waiting for the next detected frame
+
+    def push(self, frame, tracks):
+        # returns the (frame, tracks) pairs that are ready for output, in order
+        if tracks is None or isinstance(tracks, PartialTracks):
+            self.pending.append((frame, tracks))
+            return []
 
-    while True:
+        between = interpolate_tracks(self.last_tracks, tracks, len(self.pending))
+        ready = [(pending, merge_partial(interpolated, partial))
+                 for (pending, partial), interpolated in zip(self.pending, between)]
+        ready.append((frame, tracks))
+        self.pending = []
+        self.last_tracks = tracks
+        return ready
+
+    def feed(self, frames, tracks_list):
+        for frame, tracks in zip(frames, tracks_list):
+            yield from self.push(frame, tracks)
+
+    def flush(self):
+        # no detection after the last skipped frames, hold the last known boxes
+        ready = [(frame, merge_partial(self.last_tracks, partial)) for frame, partial in self.pending]
+        self.pending = []
+        return ready
+
+# -------------------------------
+# video capture with decoder options and reusable frame buffers
+# -------------------------------
+def open_capture(video_path, decode_threads=0, hw_accel=False):
+    # decode_threads 0 lets FFmpeg pick, hw_accel asks for any available hardware decoder (falls back to
+    # software when there is none); options are skipped on OpenCV builds without them
+    params = []
+    if decode_threads and hasattr(cv2, "CAP_PROP_N_THREADS"):
+        params += [cv2.CAP_PROP_N_THREADS, decode_threads]
+    if hw_accel and hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+        params += [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    if params:
+        return cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, params)
+    return cv2.VideoCapture(video_path)
+
+class FrameRing:
+    # decodes into a fixed ring of preallocated buffers instead of a new array per frame;
+    # a buffer is overwritten again after `size` reads, so size must cover every frame still in flight
+    def __init__(self, cap, size):
+        self.cap = cap
+        self.buffers = [None] * size
+        self.index = 0
+
+    def read(self):
+        ret, frame = self.cap.read(self.buffers[self.index])
+        if ret:
+            self.buffers[self.index] = frame
+            self.index = (self.index + 1) % len(self.buffers)
+        return ret, frame
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def release(self):
+        self.cap.release()
+
+class FrameReader:
+    # random access by frame number as used in the track logs and possessions' start_frame (first frame = 1);
+    # only seeks when the requested frame is not the next one, the returned frame is reused by the next call
+    def __init__(self, video_path, decode_threads=0, hw_accel=False):
+        self.cap = open_capture(video_path, decode_threads, hw_accel)
+        self.next_frame = 1
+        self.buffer = None
+
+    def read_at(self, frame_number):
+        if frame_number != self.next_frame:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number - 1)
+        ret, frame = self.cap.read(self.buffer)
+        if not ret:
+            self.next_frame = None
+            return None
+        self.buffer = frame
+        self.next_frame = frame_number + 1
+        return frame
+
+    def release(self):
+        self.cap.release()
+
+# -------------------------------
+# live frame source: background reader that keeps only the latest frames
+# -------------------------------
+# "-" reads raw bgr24 frames of frame_size from stdin and "pipe:PATH" from a named pipe, e.g.
+#   ffmpeg -i rtsp://camera/stream -f rawvideo -pix_fmt bgr24 - | python tracking_france_usa_withlimitedid.py --live --video - --frame-size 1280x720
+# a local file is played back at its own frame rate as a stand-in for a camera, stream urls go through OpenCV
+SOURCE_OPTIONS = {"live": False, "buffer_frames": 4, "fps": None, "frame_size": None}
+
+# frames a live run can hold outside the source buffer with batch_size 1 and queue_size 1: one in each queue,
+# one in each of the decode, infer and render stages, plus stride - 1 held back by the interpolator
+LIVE_STAGE_FRAMES = 5
+
+class FrameSource:
+    # same read/get/release interface as cv2.VideoCapture; when the tracker falls behind, the oldest buffered
+    # frame is dropped. Frames already handed to the pipeline are never dropped, so main runs live sources with
+    # batch_size 1 and queue_size 1: the tracker then stays at most buffer_frames + LIVE_STAGE_FRAMES behind
+    def __init__(self, source, buffer_frames=4, fps=None, frame_size=None, decode_threads=0, hw_accel=False):
+        self.frames = deque(maxlen=buffer_frames)
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.received = 0
+        self.dropped = 0
+        self.ended = False
+
+        self.cap = None
+        self.stream = None
+        if source == "-" or source.startswith("pipe:"):
+            if not frame_size:
+                raise ValueError("raw frames from a pipe need frame_size, e.g. 1280x720")
+            width, height = (int(v) for v in str(frame_size).lower().split("x"))
+            self.shape = (height, width, 3)
+            self.stream = sys.stdin.buffer if source == "-" else open(source[len("pipe:"):], "rb")
+            self.fps = fps or 25
+            self.pace = False
+        else:
+            self.cap = open_capture(source, decode_threads, hw_accel)
+            if not self.cap.isOpened():
+                raise ValueError(f"cannot open {source}")
+            self.fps = fps or self.cap.get(cv2.CAP_PROP_FPS) or 25
+            # network streams arrive in real time by themselves
+            self.pace = os.path.isfile(source)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def next_frame(self):
+        if self.cap is not None:
+            ret, frame = self.cap.read()
+            return frame if ret else None
+        # read straight into a new writable frame, the overlay is drawn on it later
+        frame = np.empty(self.shape, dtype=np.uint8)
+        view = memoryview(frame.reshape(-1))
+        filled = 0
+        while filled < len(view):
+            count = self.stream.readinto(view[filled:])
+            if not count:
+                return None
+            filled += count
+        return frame
+
+    def run(self):
+        due = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                frame = self.next_frame()
+                if frame is None:
+                    break
+                if self.pace:
+                    due += 1 / self.fps
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                with self.condition:
+                    if len(self.frames) == self.frames.maxlen:
+                        self.dropped += 1
+                    self.frames.append(frame)
+                    self.received += 1
+                    self.condition.notify()
+        finally:
+            if self.cap is not None:
+                self.cap.release()
+            if self.stream is not None and self.stream is not sys.stdin.buffer:
+                self.stream.close()
+            with self.condition:
+                self.ended = True
+                self.condition.notify_all()
+
+    def read(self, image=None):
+        # blocks until a frame is buffered, frames are not decoded into image since they are produced ahead
+        with self.condition:
+            while not self.frames and not self.ended:
+                self.condition.wait()
+            if not self.frames:
+                return False, None
+            return True, self.frames.popleft()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0
+
+    def release(self):
+        self.stop_event.set()
+        self.thread.join(timeout=1)
+
+# -------------------------------
+# read up to batch_size frames
+# -------------------------------
+def read_batch(cap, batch_size):
+    start = time.perf_counter()
+    frames = []
+    while len(frames) < batch_size:
         ret, frame = cap.read()
         if not ret:
             break
+        frames.append(frame)
+    if frames:
+        stage_times.add("decode", time.perf_counter() - start, len(frames))
+    return frames
+
+# -------------------------------
+# pixel -> pitch projection, metres in the GUI's 68 x 105 pitch frame
+# -------------------------------
+def fit_homography(pixel_points, pitch_points):
+    # at least four image landmarks (e.g. box corners, centre spot) and their pitch coordinates in metres
+    H, _ = cv2.findHomography(np.asarray(pixel_points, dtype=np.float32), np.asarray(pitch_points, dtype=np.float32))
+    return H
+
+def load_homographies(path):
+    # JSON list of {"start_frame": n, "H": 3x3}, each homography holds from its start_frame until the next one
+    with open(path) as f:
+        entries = json.load(f)
+    entries = sorted(entries, key=lambda entry: entry["start_frame"])
+    return [entry["start_frame"] for entry in entries], [np.array(entry["H"], dtype=np.float64) for entry in entries]
+
+def homography_at(homographies, frame_count):
+    if not homographies:
+        return None
+    start_frames, matrices = homographies
+    i = bisect.bisect_right(start_frames, frame_count) - 1
+    return matrices[i] if i >= 0 else None
+
+def project_boxes(boxes, H):
+    # bottom-centre (foot point) of every [N, 4] xyxy box through H in one matrix product -> [N, 2] metres
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    feet = np.column_stack(((boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3], np.ones(len(boxes))))
+    projected = feet @ H.T
+    return projected[:, :2] / projected[:, 2:3]
+
+def project_tracks(tracks, frame_count, homographies):
+    # NaN rows when no homography covers this frame
+    H = homography_at(homographies, frame_count)
+    if H is None:
+        return np.full((len(tracks), 2), np.nan)
+    return project_boxes([box for _, _, _, box in tracks], H)
+
+# -------------------------------
+# columnar binary track log
+# -------------------------------
+# one raw little-endian file per column, rows appended in frame order, group is an index into GROUP_KEYS
+TRACK_LOG_COLUMNS = {
+    "frame": ("<i4", ()),
+    "id": ("<u2", ()),
+    "group": ("u1", ()),
+    "bbox": ("<f4", (4,)),
+    "location_m": ("<f4", (2,)),  # foot point on the pitch, NaN without a homography
+}
+
+class TrackLog:
+    def __init__(self, path, flush_rows=4096):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"columns": {name: [dtype, list(shape)] for name, (dtype, shape) in TRACK_LOG_COLUMNS.items()},
+                       "groups": list(GROUP_KEYS)}, f, indent=2)
+
+        # a new log per run, rows are only ever appended while it is open
+        self.files = {name: open(os.path.join(path, f"{name}.bin"), "wb") for name in TRACK_LOG_COLUMNS}
+        # rows are staged in preallocated column buffers and written in blocks
+        self.buffers = {name: np.empty((flush_rows, *shape), dtype=dtype)
+                        for name, (dtype, shape) in TRACK_LOG_COLUMNS.items()}
+        self.rows = 0
+
+    def append(self, frame_count, tracks, locations=None):
+        for k, (assigned_id, g_key, _, box) in enumerate(tracks):
+            if self.rows == len(self.buffers["frame"]):
+                self.flush()
+            i = self.rows
+            self.buffers["frame"][i] = frame_count
+            self.buffers["id"][i] = assigned_id
+            self.buffers["group"][i] = GROUP_KEYS.index(g_key)
+            self.buffers["bbox"][i] = box
+            self.buffers["location_m"][i] = np.nan if locations is None else locations[k]
+            self.rows += 1
+
+    def flush(self):
+        for name, f in self.files.items():
+            self.buffers[name][:self.rows].tofile(f)
+            f.flush()
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+def load_track_log(path):
+    # memory-maps every column without reading it, returns (columns, group names)
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+
+    column_rows = {}
+    for name, (dtype, shape) in meta["columns"].items():
+        row_size = np.dtype(dtype).itemsize * int(np.prod(shape))
+        column_rows[name] = os.path.getsize(os.path.join(path, f"{name}.bin")) // row_size
+    # flush writes the columns one after another, a run killed in between leaves some columns longer;
+    # only the rows every column has are complete
+    rows = min(column_rows.values(), default=0)
+
+    columns = {}
+    for name, (dtype, shape) in meta["columns"].items():
+        column_path = os.path.join(path, f"{name}.bin")
+        if rows:
+            columns[name] = np.memmap(column_path, dtype=dtype, mode="r", shape=(rows, *shape))
+        else:
+            # numpy cannot map an empty file
+            columns[name] = np.empty((0, *shape), dtype=dtype)
+    return columns, meta["groups"]
+
+# -------------------------------
+# on-disk cache of raw tracker output, so reruns with other id settings skip inference
+# -------------------------------
+def file_digest(path, sample_blocks=None, block_size=1 << 20):
+    # blake2b of the file; sample_blocks hashes only that many evenly spaced blocks plus the size,
+    # which is enough to tell match videos apart without reading gigabytes
+    digest = hashlib.blake2b(digest_size=16)
+    if not os.path.isfile(path):
+        # hub model names and stream urls are keyed by name
+        digest.update(path.encode())
+        return digest.hexdigest()
+
+    size = os.path.getsize(path)
+    digest.update(str(size).encode())
+    with open(path, "rb") as f:
+        if sample_blocks is None or size <= sample_blocks * block_size:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        else:
+            for offset in np.linspace(0, size - block_size, sample_blocks).astype(np.int64):
+                f.seek(int(offset))
+                digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+def detection_cache_path(cache_dir, video_path, model_path, tracker_type, infer_options=INFER_OPTIONS):
+    # one cache per video content, model weights and everything that changes the raw tracker output,
+    # the tracker yaml by content so edited thresholds or buffers never replay an old cache
+    settings = json.dumps([file_digest(tracker_type), infer_options.get("scale", 1.0), infer_options.get("imgsz"),
+                           infer_options.get("stride", 1)])
+    key = "_".join((file_digest(video_path, sample_blocks=64), file_digest(model_path),
+                    hashlib.blake2b(settings.encode(), digest_size=4).hexdigest()))
+    return os.path.join(cache_dir, key)
+
+class DetectionCache:
+    # raw [N, 7] boxes.data rows per frame (boxes at source resolution) and a (start, count) index per
+    # frame number, count -1 for frames the stride skipped. A complete cache is replayed instead of running
+    # the model; anything else (new or interrupted) is recorded from scratch, the tracker state of a
+    # partial run cannot be resumed
+    def __init__(self, path, names=None):
+        self.path = path
+        self.names = names  # model class names, stored so the cache can be replayed without the model
+        meta_path = os.path.join(path, "meta.json")
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        self.replay = bool(meta and meta.get("complete"))
+
+        if self.replay:
+            self.frames = meta["frames"]
+            self.names = {int(cls): class_name for cls, class_name in meta["names"].items()}
+            self.index = np.fromfile(os.path.join(path, "frames.bin"), dtype="<i8").reshape(-1, 2)
+            rows = os.path.getsize(os.path.join(path, "detections.bin")) // (7 * 4)
+            self.rows = (np.memmap(os.path.join(path, "detections.bin"), dtype="<f4", mode="r", shape=(rows, 7))
+                         if rows else np.empty((0, 7), dtype="<f4"))
+        else:
+            os.makedirs(path, exist_ok=True)
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            self.frames = 0  # last detected frame
+            self.seen = 0  # frames passed through track_batch, detected or not
+            self.row_count = 0
+            self.rows_file = open(os.path.join(path, "detections.bin"), "wb")
+            self.index_file = open(os.path.join(path, "frames.bin"), "wb")
+
+    def get(self, frame_count):
+        # detections of one frame, None for frames that were not detected or are past the end
+        if frame_count > len(self.index):
+            return None
+        start, count = self.index[frame_count - 1]
+        if count < 0:
+            return None
+        return self.rows[start:start + count]
+
+    def put(self, frame_count, detections):
+        # frames arrive in order, frames skipped in between are marked as not detected
+        skipped = frame_count - self.frames - 1
+        if skipped > 0:
+            np.full((skipped, 2), (self.row_count, -1), dtype="<i8").tofile(self.index_file)
+        count = 0 if detections is None else len(detections)
+        np.array((self.row_count, count), dtype="<i8").tofile(self.index_file)
+        if count:
+            np.ascontiguousarray(detections, dtype="<f4").tofile(self.rows_file)
+        self.row_count += count
+        self.frames = frame_count
+
+    def close(self, complete=True):
+        # only a run that reached the end of the video marks the cache complete
+        if self.replay:
+            return
+        self.rows_file.close()
+        self.index_file.close()
+        if not complete:
+            return
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({"frames": self.seen, "rows": self.row_count, "names": self.names, "complete": True}, f, indent=2)
+
+class BlankCapture:
+    # stands in for the video when a complete detection cache is replayed and no output needs pixels
+    def __init__(self, frames, fps=25):
+        self.frames = frames
+        self.fps = fps
+        self.position = 0
 
-        frame_count += 1
-        frame = process_frame(frame, model, tracker_type, id_map, available_ids, colors, lost_ids, delay_frames, frame_count)
-        frame = cv2.resize(frame, (1000, 800))
-        cv2.imshow(f"YOLOv8 + {tracker_type.split('.')[0].upper()}", frame)
+    def read(self, image=None):
+        if self.position >= self.frames:
+            return False, None
+        self.position += 1
+        return True, None
 
-        if cv2.waitKey(1) & 0xFF == ord("q"):
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.frames
+        return 0
+
+    def release(self):
+        pass
+
+# -------------------------------
+# output sinks: display window, annotated video, track log
+# -------------------------------
+def open_outputs(window_name=None, video_out=None, tracks_out=None, fps=25, size=(1000, 800), draw=True,
+                 track_log=None, homographies=None, possessions_out=None, hud=False):
+    outputs = {
+        "window": window_name,
+        "hud": hud,  # stage timings drawn on the displayed / written frame
+        "hud_lines": [],
+        "homographies": homographies,
+        # possessions need pitch positions, so they are only detected when homographies are given
+        "possessions": PossessionEngine() if possessions_out and homographies else None,
+        "possessions_file": PossessionWriter(possessions_out) if possessions_out and homographies else None,
+        "last_frame": 0,
+        "writer": None,
+        "tracks_file": None,
+        "tracks": None,
+        "track_log": TrackLog(track_log) if track_log else None,
+        "size": size,
+        # resize target reused for every frame instead of a new array each time
+        "buffer": np.empty((size[1], size[0], 3), dtype=np.uint8),
+        # nothing to draw on when frames are neither shown nor written
+        "draw": draw and (window_name is not None or video_out is not None),
+    }
+    if video_out:
+        outputs["writer"] = cv2.VideoWriter(video_out, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    if tracks_out:
+        outputs["tracks_file"] = open(tracks_out, "w", newline="")
+        outputs["tracks"] = csv.writer(outputs["tracks_file"])
+        outputs["tracks"].writerow(("frame", "assigned_id", "group_key", "x1", "y1", "x2", "y2", "x_m", "y_m"))
+    return outputs
+
+def output_frame(frame, tracks, frame_count, colors, outputs):
+    # returns True when the user asked to quit
+    outputs["last_frame"] = frame_count
+    locations = None
+    if outputs["homographies"] and (outputs["tracks"] is not None or outputs["track_log"] is not None
+                                    or outputs["possessions"] is not None):
+        locations = project_tracks(tracks, frame_count, outputs["homographies"])
+
+    if outputs["tracks"] is not None:
+        xy = locations.round(2).tolist() if locations is not None else [("", "")] * len(tracks)
+        outputs["tracks"].writerows((frame_count, assigned_id, g_key, x1, y1, x2, y2, x_m, y_m)
+                                    for (assigned_id, g_key, _, (x1, y1, x2, y2)), (x_m, y_m) in zip(tracks, xy))
+    if outputs["track_log"] is not None:
+        outputs["track_log"].append(frame_count, tracks, locations)
+    if outputs["possessions"] is not None:
+        for possession in outputs["possessions"].update(frame_count, tracks, locations):
+            outputs["possessions_file"].write(possession)
+
+    if outputs["window"] is None and outputs["writer"] is None:
+        stage_times.frame_done()
+        return False
+
+    if outputs["draw"]:
+        start = time.perf_counter()
+        draw_tracks(frame, tracks, colors)
+        stage_times.add("draw", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    frame = cv2.resize(frame, outputs["size"], dst=outputs["buffer"])
+    stage_times.add("resize", time.perf_counter() - start)
+    if outputs["hud"]:
+        draw_hud(frame, frame_count, outputs)
+
+    start = time.perf_counter()
+    quit_requested = False
+    if outputs["writer"] is not None:
+        outputs["writer"].write(frame)
+    if outputs["window"] is not None:
+        cv2.imshow(outputs["window"], frame)
+        quit_requested = cv2.waitKey(1) & 0xFF == ord("q")
+    stage_times.add("output", time.perf_counter() - start)
+    stage_times.frame_done()
+    return quit_requested
+
+def draw_hud(frame, frame_count, outputs, refresh_every=25):
+    # percentiles are recomputed only every refresh_every frames, drawing the cached lines is cheap
+    if frame_count % refresh_every == 1 or not outputs["hud_lines"]:
+        outputs["hud_lines"] = [f"{stage_times.fps():.1f} fps"] + [
+            f"{stage:<9} p50 {row['p50_ms']:.1f} p95 {row['p95_ms']:.1f} p99 {row['p99_ms']:.1f} ms"
+            for stage, row in stage_times.summary().items()
+        ]
+    cv2.rectangle(frame, (5, 5), (380, 12 + 16 * len(outputs["hud_lines"])), (0, 0, 0), -1)
+    for i, line in enumerate(outputs["hud_lines"]):
+        cv2.putText(frame, line, (10, 20 + 16 * i), LABEL_FONT, 0.45, (255, 255, 255), 1)
+
+def close_outputs(outputs):
+    if outputs["writer"] is not None:
+        outputs["writer"].release()
+    if outputs["tracks_file"] is not None:
+        outputs["tracks_file"].close()
+    if outputs["track_log"] is not None:
+        outputs["track_log"].close()
+    if outputs["possessions"] is not None:
+        for possession in outputs["possessions"].finish(outputs["last_frame"]):
+            outputs["possessions_file"].write(possession)
+        outputs["possessions_file"].close()
+    if outputs["window"] is not None:
+        cv2.destroyAllWindows()
+
+# -------------------------------
+# threaded decode -> infer -> render pipeline
+# -------------------------------
+def put_until_stopped(q, item, stop_event):
+    # blocking put that still gives up once the pipeline is stopped
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def decode_worker(cap, batch_size, decode_q, stop_event, errors):
+    # errors collects the exception that ended the worker, run_pipeline re-raises it
+    try:
+        while not stop_event.is_set():
+            frames = read_batch(cap, batch_size)
+            if not frames or not put_until_stopped(decode_q, frames, stop_event):
+                break
+    except Exception as error:
+        errors.append(error)
+    finally:
+        put_until_stopped(decode_q, None, stop_event)
+
+def infer_worker(decode_q, render_q, model, tracker_type, id_map, available_ids, lost_ids, delay_frames, infer_options,
+                 stop_event, errors, cache=None, ball_tracker=None, reid=None, long_run=None):
+    frame_count = 0
+    try:
+        while not stop_event.is_set():
+            try:
+                frames = decode_q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if frames is None:
+                break
+
+            tracks_list = track_batch(frames, model, tracker_type, id_map, available_ids, lost_ids, delay_frames,
+                                      frame_count, infer_options, cache, ball_tracker, reid, long_run)
+            frame_count += len(frames)
+            if not put_until_stopped(render_q, (frames, tracks_list), stop_event):
+                break
+    except Exception as error:
+        errors.append(error)
+    finally:
+        put_until_stopped(render_q, None, stop_event)
+
+def run_pipeline(cap, model, tracker_type, id_map, available_ids, colors, lost_ids, delay_frames, outputs,
+                 batch_size=8, queue_size=4, report_every=250, infer_options=INFER_OPTIONS, cache=None,
+                 ball_tracker=None, reid=None, long_run=None):
+    decode_q = queue.Queue(maxsize=queue_size)
+    render_q = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    errors = []
+
+    # frames in flight: both queues, one batch in every stage and the frames held back by the interpolator
+    ring = FrameRing(cap, (2 * queue_size + 4) * batch_size + infer_options.get("stride", 1))
+
+    workers = [
+        threading.Thread(target=decode_worker, args=(ring, batch_size, decode_q, stop_event, errors), daemon=True),
+        threading.Thread(target=infer_worker, args=(decode_q, render_q, model, tracker_type, id_map,
+                                                    available_ids, lost_ids, delay_frames, infer_options,
+                                                    stop_event, errors, cache, ball_tracker, reid, long_run),
+                         daemon=True),
+    ]
+    for worker in workers:
+        worker.start()
+
+    # rendering stays on the main thread, imshow/waitKey are not thread safe on every platform
+    interpolator = TrackInterpolator()
+    frame_count = 0
+    while not stop_event.is_set():
+        item = render_q.get()
+        if item is None and errors:
+            # a worker failed, the frames held back are not the end of the video
+            break
+        ready = interpolator.flush() if item is None else interpolator.feed(*item)
+
+        for frame, tracks in ready:
+            frame_count += 1
+            quit_requested = output_frame(frame, tracks, frame_count, colors, outputs)
+
+            if report_every and frame_count % report_every == 0:
+                dropped = f" | dropped {cap.dropped}" if isinstance(cap, FrameSource) else ""
+                print(f"frame {frame_count} | decode queue {decode_q.qsize()}/{queue_size} | "
+                      f"render queue {render_q.qsize()}/{queue_size}{dropped}")
+
+            if quit_requested:
+                stop_event.set()
+                break
+
+        if item is None:
             break
 
+    stop_event.set()
+    for worker in workers:
+        worker.join()
+    if errors:
+        # not a finished run, outputs must not be closed as if the video had ended
+        raise errors[0]
+    return frame_count
+
+# -------------------------------
+# single threaded loop, same outputs as run_pipeline
+# -------------------------------
+def run_serial(cap, model, tracker_type, id_map, available_ids, colors, lost_ids, delay_frames, outputs,
+               batch_size=8, infer_options=INFER_OPTIONS, cache=None, ball_tracker=None, reid=None, long_run=None):
+    ring = FrameRing(cap, 2 * batch_size + infer_options.get("stride", 1))
+    interpolator = TrackInterpolator()
+    frames_read = 0
+    frame_count = 0
+    stop = False
+    while not stop:
+        frames = read_batch(ring, batch_size)
+        if frames:
+            tracks_list = track_batch(frames, model, tracker_type, id_map, available_ids, lost_ids, delay_frames,
+                                      frames_read, infer_options, cache, ball_tracker, reid, long_run)
+            frames_read += len(frames)
+            ready = interpolator.feed(frames, tracks_list)
+        else:
+            ready = interpolator.flush()
+            stop = True
+
+        for frame, tracks in ready:
+            frame_count += 1
+            if output_frame(frame, tracks, frame_count, colors, outputs):
+                stop = True
+                break
+    return frame_count
+
+# -------------------------------
+# run profile: json file + command line overrides
+# -------------------------------
+DEFAULT_PROFILE = {
+    "model_path": "OD_YOLO11_V2.pt",
+    "video_path": "france_usa_final.mp4",
+    "tracker_type": "botsort_custom.yaml",
+    "delay_frames": 10,
+    "id_pools": ID_POOL_SIZES,
+    "colors": GROUP_COLORS,
+    "batch_size": 8,  # frames per detector call
+    "infer": INFER_OPTIONS,
+    "ball": BALL_OPTIONS,
+    "reid": REID_OPTIONS,
+    "long_run": LONG_RUN_OPTIONS,
+    "pipeline": True,  # overlap decoding and drawing with inference
+    "queue_size": 4,
+    "decode_threads": 0,  # FFmpeg decoder threads, 0 = FFmpeg default
+    "hw_accel": False,  # hardware video decoding where the OpenCV / FFmpeg build supports it
+    "workers": 0,  # processes / concurrent videos for the sharded and batch runners, 0 = one per core
+    "detection_cache": None,  # directory of raw tracker output caches, reruns of the same video skip inference
+    "source": SOURCE_OPTIONS,
+    "outputs": {
+        "headless": False,  # no display window, run unattended at full speed
+        "draw_boxes": True,  # False writes raw frames and skips the overlay cost
+        "display_size": [1000, 800],
+        "video_out": None,
+        "tracks_out": None,
+        "track_log": None,
+        "homographies": None,
+        "possessions_out": None,
+        "hud": False,  # live fps and per-stage latency on the frame
+        "timing_report": None,  # per-stage p50/p95/p99 written at the end of the run, .csv or .json
+        "memory_report": None,  # long-run memory reports as JSON, written at the end of the run
+    },
+}
+
+def load_profile(path=None, overrides=None):
+    # profile file values replace the defaults, nested sections key by key; overrides use "section.key" names
+    profile = {key: dict(value) if isinstance(value, dict) else value for key, value in DEFAULT_PROFILE.items()}
+    if path:
+        with open(path) as f:
+            for key, value in json.load(f).items():
+                if isinstance(profile.get(key), dict) and key not in ("id_pools", "colors"):
+                    profile[key].update(value)
+                else:
+                    profile[key] = value
+
+    for name, value in (overrides or {}).items():
+        if value is None:
+            continue
+        section, _, key = name.rpartition(".")
+        (profile[section] if section else profile)[key] = value
+
+    # JSON has no tuples, but OpenCV colors and sprite cache keys need them
+    profile["colors"] = {g_key: tuple(color) for g_key, color in profile["colors"].items()}
+    return profile
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Track players, referees and ball with fixed per-group ids.")
+    parser.add_argument("--profile", help="JSON run profile, see tracking_profile.json")
+    overrides = parser.add_argument_group("profile overrides")
+    overrides.add_argument("--model", dest="model_path")
+    overrides.add_argument("--video", dest="video_path")
+    overrides.add_argument("--tracker", dest="tracker_type")
+    overrides.add_argument("--delay-frames", dest="delay_frames", type=int)
+    overrides.add_argument("--batch-size", dest="batch_size", type=int)
+    overrides.add_argument("--infer-scale", dest="infer.scale", type=float)
+    overrides.add_argument("--imgsz", dest="infer.imgsz", type=int)
+    overrides.add_argument("--stride", dest="infer.stride", type=int)
+    overrides.add_argument("--device", dest="infer.device")
+    overrides.add_argument("--ball-roi", dest="ball.enabled", action="store_const", const=True)
+    overrides.add_argument("--ball-roi-size", dest="ball.roi_size", type=int)
+    overrides.add_argument("--reid", dest="reid.enabled", action="store_const", const=True)
+    overrides.add_argument("--long-run", dest="long_run.enabled", action="store_const", const=True)
+    overrides.add_argument("--serial", dest="pipeline", action="store_const", const=False)
+    overrides.add_argument("--decode-threads", dest="decode_threads", type=int)
+    overrides.add_argument("--hw-accel", dest="hw_accel", action="store_const", const=True)
+    overrides.add_argument("--workers", dest="workers", type=int)
+    overrides.add_argument("--detection-cache", dest="detection_cache")
+    overrides.add_argument("--live", dest="source.live", action="store_const", const=True)
+    overrides.add_argument("--buffer-frames", dest="source.buffer_frames", type=int)
+    overrides.add_argument("--frame-size", dest="source.frame_size", help="WIDTHxHEIGHT of raw frames on a pipe")
+    overrides.add_argument("--headless", dest="outputs.headless", action="store_const", const=True)
+    overrides.add_argument("--no-draw", dest="outputs.draw_boxes", action="store_const", const=False)
+    overrides.add_argument("--video-out", dest="outputs.video_out")
+    overrides.add_argument("--tracks-out", dest="outputs.tracks_out")
+    overrides.add_argument("--track-log", dest="outputs.track_log")
+    overrides.add_argument("--homographies", dest="outputs.homographies")
+    overrides.add_argument("--possessions-out", dest="outputs.possessions_out")
+    overrides.add_argument("--hud", dest="outputs.hud", action="store_const", const=True)
+    overrides.add_argument("--timing-report", dest="outputs.timing_report")
+    overrides.add_argument("--memory-report", dest="outputs.memory_report")
+
+    args = vars(parser.parse_args(argv))
+    return load_profile(args.pop("profile"), args)
+
+# -------------------------------
+# Main Function
+# -------------------------------
+def main(argv=None):
+    profile = parse_args(argv)
+    tracker_type = profile["tracker_type"]
+    out = profile["outputs"]
+
+    model = YOLO(profile["model_path"])
+    get_group_lut(model.names)
+    source = profile["source"]
+    batch_size, queue_size = profile["batch_size"], profile["queue_size"]
+    if source["live"]:
+        cap = FrameSource(profile["video_path"], source["buffer_frames"], source["fps"], source["frame_size"],
+                          profile["decode_threads"], profile["hw_accel"])
+        # frames only get dropped in the source buffer, anything batched or queued behind it adds latency
+        batch_size, queue_size = 1, 1
+    else:
+        cap = open_capture(profile["video_path"], profile["decode_threads"], profile["hw_accel"])
+
+    cache = None
+    # a live run drops frames depending on load, its raw output cannot be replayed as the video's
+    if profile["detection_cache"] and not source["live"]:
+        cache = DetectionCache(detection_cache_path(profile["detection_cache"], profile["video_path"],
+                                                    profile["model_path"], tracker_type, profile["infer"]),
+                               model.names)
+        print(f"detection cache {'replay' if cache.replay else 'record'}: {cache.path}")
+        if (cache.replay and out["headless"] and not out["video_out"] and not profile["ball"]["enabled"]
+                and not profile["reid"]["enabled"]):
+            # nothing shows or writes pixels, skip decoding as well
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25
+            cap.release()
+            cap = BlankCapture(cache.frames, fps)
+
+    id_map = {}
+    lost_ids = OrderedDict()
+    available_ids = build_id_pools(profile["id_pools"])
+    # created before the first track call, so the view does not inherit the tracker callbacks
+    ball_tracker = BallTracker(model, profile["ball"], profile["infer"]["device"]) if profile["ball"]["enabled"] else None
+    reid = AppearanceStore(sum(profile["id_pools"].values()), profile["reid"]) if profile["reid"]["enabled"] else None
+    long_run = LongRunGuard(profile["long_run"]) if profile["long_run"]["enabled"] else None
+
+    window_name = None if out["headless"] else f"YOLOv8 + {tracker_type.split('.')[0].upper()}"
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    homographies = load_homographies(out["homographies"]) if out["homographies"] else None
+    outputs = open_outputs(window_name, out["video_out"], out["tracks_out"], fps, tuple(out["display_size"]),
+                           out["draw_boxes"], out["track_log"], homographies, out["possessions_out"], out["hud"])
+
+    start_time = time.perf_counter()
+
+    if profile["pipeline"]:
+        frame_count = run_pipeline(cap, model, tracker_type, id_map, available_ids, profile["colors"], lost_ids,
+                                   profile["delay_frames"], outputs, batch_size, queue_size,
+                                   infer_options=profile["infer"], cache=cache, ball_tracker=ball_tracker, reid=reid,
+                                   long_run=long_run)
+    else:
+        frame_count = run_serial(cap, model, tracker_type, id_map, available_ids, profile["colors"], lost_ids,
+                                 profile["delay_frames"], outputs, batch_size, profile["infer"], cache,
+                                 ball_tracker, reid, long_run)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"{frame_count} frames in {elapsed:.1f}s ({frame_count / max(elapsed, 1e-9):.1f} fps)")
+    if isinstance(cap, FrameSource):
+        print(f"source: {cap.received} frames received, {cap.dropped} dropped")
+
+    if ball_tracker is not None:
+        print(f"ball crops: {ball_tracker.found}/{ball_tracker.searched} found")
+    if reid is not None:
+        print(f"re-identified tracks: {reid.matched}")
+    if long_run is not None:
+        print(format_memory_report(long_run.report(frame_count, model, lost_ids, reid)))
+        if out["memory_report"]:
+            with open(out["memory_report"], "w") as f:
+                json.dump(long_run.reports, f, indent=2)
+    if cache is not None and not cache.replay:
+        # a run stopped with q leaves frames untracked or the video unread, that cache is not reused
+        cache.close(complete=frame_count == cache.seen and not cap.read()[0])
     cap.release()
-    cv2.destroyAllWindows()
+    close_outputs(outputs)
+    if out["timing_report"]:
+        stage_times.write_report(out["timing_report"])
 
 if __name__ == "__main__":
     main()